@@ -1,9 +1,13 @@
+import hashlib
 import itertools
-from copy import copy, deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from dataclasses import dataclass
 from pprint import pprint
+from typing import List, Optional, Sequence, Tuple
 
-from qiskit import schedule as build_schedule, QuantumCircuit
-from qiskit.circuit import Barrier
+from qiskit import QuantumCircuit, transpile
+from qiskit.circuit import Barrier, Parameter, ParameterExpression
 from qiskit.pulse import Play, ShiftPhase, Schedule, Acquire, AcquireChannel, MemorySlot, MeasureChannel, \
     ControlChannel, DriveChannel
 import numpy as np
@@ -14,20 +18,102 @@ from gatelevel_qiskit.pulse_backend import PulseBackend
 
 _play_channels = {MeasureChannel, ControlChannel, DriveChannel}
 
+# a row of `CircuitQuaTransformer.to_waveform_arrays`
+waveform_dtype = np.dtype([('timestamp', float),
+                           ('duration', float),
+                           ('frequency', float),
+                           ('phase', float),
+                           ('waveform_id', np.int32)])
+
+# the operation that the measure elements play for a measurement
+measure_operation = 'test_pulse_1'  # todo: this is hardcoded, take it from the measure elements of the config
+
+
+def _waveform_entry(samples: np.ndarray):
+    # waveforms are named by their content, so identical sample arrays share a single config entry whatever the name
+    # of the qiskit instruction that plays them. constant arrays become constant waveforms
+    samples = np.ascontiguousarray(samples, dtype=float)
+    if samples.size > 0 and np.all(samples == samples[0]):
+        return f"const_{hashlib.sha1(samples[:1].tobytes()).hexdigest()[:16]}", \
+               {'type': 'constant', 'sample': float(samples[0])}
+    return f"wf_{hashlib.sha1(samples.tobytes()).hexdigest()[:16]}", \
+           {'type': 'arbitrary', 'samples': samples.tolist()}
+
+
+@dataclass(frozen=True)
+class ParametricPhase:
+    """
+    the phase offset + sum(coefficient * args[index]) of a frame rotation that depends on the circuit parameters,
+    where args holds the values of `CircuitQuaTransformer.parameters`
+    """
+    offset: float
+    terms: Tuple[Tuple[int, float], ...]
+
+    def value(self, parameter_values: Sequence[float]) -> float:
+        return self.offset + sum(coefficient * parameter_values[index] for index, coefficient in self.terms)
+
+    def to_qua_str(self) -> str:
+        terms = [f"args[{index}]" if coefficient == 1 else f"{coefficient} * args[{index}]"
+                 for index, coefficient in self.terms]
+        if self.offset != 0:
+            terms.append(str(self.offset))
+        return " + ".join(terms)
+
+    def to_qua(self, args):
+        expression = None
+        for index, coefficient in self.terms:
+            term = args[index] if coefficient == 1 else coefficient * args[index]
+            expression = term if expression is None else expression + term
+        return expression + self.offset if self.offset != 0 else expression
+
 
 class CircuitQuaTransformer:
     def __init__(self,
                  pulse_backend: PulseBackend,
                  config_base: dict,
-                 circuit: QuantumCircuit):
+                 circuit: QuantumCircuit,
+                 cache_schedule: bool = False,
+                 compact: bool = True,
+                 parameters: Optional[Sequence[Parameter]] = None):
+        """
+        :param cache_schedule: reuse the schedule of a structurally identical circuit transformed before with the same
+                               pulse backend, see `PulseBackend.build_schedule`
+        :param compact: merge the frame rotations and waits of the generated QUA code, see `compact_qua_ops`
+        :param parameters: the order of the parameter values in `args`, which may include parameters the circuit does
+                           not use. the circuit parameters sorted by name by default
+
+        unbound parameters of the circuit are kept in the schedule, and the frame rotations that depend on them read
+        the parameter values from a QUA fixed array `args`, ordered like `parameters`. a single program then serves
+        every assignment of the parameters
+        """
         self._circuit = circuit
+        if parameters is None:
+            self.parameters = sorted(circuit.parameters, key=lambda parameter: parameter.name)
+        else:
+            missing = set(circuit.parameters) - set(parameters)
+            if missing:
+                raise ValueError(f"the parameters {sorted(parameter.name for parameter in missing)} of the circuit "
+                                 f"are not in parameters")
+            self.parameters = list(parameters)
+        self._cache_schedule = cache_schedule
+        self._compact = compact
         self._channel_port_map = CircuitQuaTransformer._create_channel_port_map(config_base)
         self._channel_freq_map = CircuitQuaTransformer._create_chan_freq_map(config_base)
         self._config_base = config_base
         self._pulse_backend = pulse_backend
-        self.config = self._to_config()
+        # the circuit is scheduled once, the config and the QUA code are both generated from this schedule
         self._pulse_backend.add_measure_pulses(config_base)
         self._schedule = self._circuit_to_schedule(circuit)
+        self._config = None
+        self._waveform_cache = {}
+        self._qua_ops = None
+
+    @property
+    def config(self):
+        # built on first use, `BatchCircuitQuaTransformer` only needs the config fragments of its circuits
+        if self._config is None:
+            self._config = self._to_config()
+        return self._config
 
     @staticmethod
     def _create_channel_port_map(config_base):
@@ -53,8 +139,7 @@ class CircuitQuaTransformer:
         return ch_freq_map
 
     def _circuit_to_schedule(self, circuit: QuantumCircuit):
-        return build_schedule(circuit, self._pulse_backend.backend,
-                              inst_map=self._pulse_backend.instruction_schedule_map)
+        return self._pulse_backend.build_schedule(circuit, use_cache=self._cache_schedule)
 
     def _channel_to_port(self, channel, quad):
         return self._channel_port_map[channel.name + "_" + quad]
@@ -67,93 +152,180 @@ class CircuitQuaTransformer:
                 chans_pulse_dict[inst[1].channel].add(inst[1].name)
         return chans_pulse_dict
 
-    def to_waveforms(self, init_time=0.0):
-        schedule = self._schedule
-        inst_dict = {}
-        accumulated_phases = {chan: 0.0 for chan in schedule.channels}
+    def _play_waveforms(self, inst: Play):
+        """
+        the (name, waveform) entries of the I and Q quadratures of a drive or control pulse
+        """
+        key = id(inst.pulse)
+        if key not in self._waveform_cache:
+            samples = inst.pulse.samples
+            self._waveform_cache[key] = (_waveform_entry(samples.real), _waveform_entry(samples.imag))
+        return self._waveform_cache[key]
 
-        inst_seq = schedule.instructions
-        for inst_tuple in inst_seq:
-            start_time, inst = inst_tuple
+    def _to_phase(self, phase):
+        # a float, or a ParametricPhase for a phase that depends on the unbound circuit parameters
+        if not isinstance(phase, ParameterExpression) or not phase.parameters:
+            return float(phase)
+        parameter_index = {parameter: index for index, parameter in enumerate(self.parameters)}
+        parameters = sorted(phase.parameters, key=lambda parameter: parameter.name)
+        zeros = {parameter: 0 for parameter in parameters}
+        offset = float(phase.bind(zeros))
+        parametric_phase = ParametricPhase(offset, tuple(
+            (parameter_index[parameter], float(phase.bind({**zeros, parameter: 1})) - offset)
+            for parameter in parameters))
+        # QUA can only evaluate it as a linear combination of the parameters
+        test_values = {parameter: index + 2.0 for index, parameter in enumerate(parameters)}
+        test_args = np.zeros(len(self.parameters))
+        for parameter, value in test_values.items():
+            test_args[parameter_index[parameter]] = value
+        if not np.isclose(float(phase.bind(test_values)), parametric_phase.value(test_args)):
+            raise ValueError(f"the phase {phase} is not linear in the circuit parameters")
+        return parametric_phase
+
+    def to_waveform_arrays(self, init_time=0.0, parameter_values: Optional[Sequence[float]] = None):
+        """
+        the pulses played by the circuit, in columns
+
+        :param parameter_values: the values of `parameters`, required for a circuit with unbound parameters
+        :return: a tuple (arrays, waveform_names). arrays[con][port] is an array of `waveform_dtype` with a row per
+                 pulse played on the port, in the order they are played, and its waveform_id indexes waveform_names
+        """
+        schedule = self._schedule
+        channel_ids = {chan: index for index, chan in enumerate(schedule.channels)}
+        # every ShiftPhase and Play is an event on its channel, the phase of a Play is the cumulative sum of the
+        # phase shifts of the events of its channel up to and including it
+        event_channels = []
+        event_phases = []
+        plays = []
+        for start_time, inst in schedule.instructions:
             if isinstance(inst, ShiftPhase):
-                accumulated_phases[inst.channel] += inst.phase
+                phase = self._to_phase(inst.phase)
+                if isinstance(phase, ParametricPhase):
+                    if parameter_values is None:
+                        raise ValueError("parameter_values are required for a circuit with unbound parameters")
+                    phase = phase.value(parameter_values)
+                event_channels.append(channel_ids[inst.channel])
+                event_phases.append(phase)
             elif isinstance(inst, Play):
-                phase_wrapped = (accumulated_phases[inst.channel] - np.pi) % (2 * np.pi) - np.pi
-                if phase_wrapped == -np.pi:
-                    phase_wrapped = np.pi  # hack to make compatible with simulator
-                inst_pre = {
-                    'duration': float(inst.pulse.duration),
-                    'frequency': self._channel_freq_map[inst.channel],
-                    'phase': phase_wrapped,
-                    'timestamp': float(start_time) + init_time,
-                }
-                inst_i = copy(inst_pre)
-                inst_i['name'] = inst.name + "_i"
-                inst_q = copy(inst_pre)
-                inst_q['name'] = inst.name + "_q"
-                port_i = self._channel_to_port(inst.channel, "i")
-                port_q = self._channel_to_port(inst.channel, "q")
-
-                if not port_i[0] in inst_dict:
-                    inst_dict[port_i[0]] = {}
-                if not str(port_i[1]) in inst_dict[port_i[0]]:
-                    inst_dict[port_i[0]][str(port_i[1])] = []
-                inst_dict[port_i[0]][str(port_i[1])].append(inst_i)
-
-                if not port_q[0] in inst_dict:
-                    inst_dict[port_q[0]] = {}
-                if not str(port_q[1]) in inst_dict[port_q[0]]:
-                    inst_dict[port_q[0]][str(port_q[1])] = []
-                inst_dict[port_q[0]][str(port_q[1])].append(inst_q)
-
+                plays.append((len(event_channels), start_time, inst))
+                event_channels.append(channel_ids[inst.channel])
+                event_phases.append(0.0)
             elif isinstance(inst, Acquire):
                 pass
             else:
                 raise ValueError(f"unknown instruction type {inst}")
 
-        inst_dict = {key: value for key, value in inst_dict.items() if len(value) > 0}
+        event_channels = np.array(event_channels, dtype=int)
+        event_phases = np.array(event_phases, dtype=float)
+        accumulated_phases = np.empty_like(event_phases)
+        for channel_id in np.unique(event_channels):
+            mask = event_channels == channel_id
+            accumulated_phases[mask] = np.cumsum(event_phases[mask])
+        play_phases = accumulated_phases[np.array([play[0] for play in plays], dtype=int)]
+        play_phases = (play_phases - np.pi) % (2 * np.pi) - np.pi
+        play_phases[play_phases == -np.pi] = np.pi  # hack to make compatible with simulator
+
+        waveform_ids = {}
+        port_rows = {}
+        for play_index, (_, start_time, inst) in enumerate(plays):
+            if isinstance(inst.channel, MeasureChannel):
+                names = (inst.name + "_i", inst.name + "_q")
+            else:
+                (name_i, _), (name_q, _) = self._play_waveforms(inst)
+                names = (name_i, name_q)
+            for quad, name in zip("iq", names):
+                port_rows.setdefault(self._channel_to_port(inst.channel, quad), []).append(
+                    (float(start_time) + init_time,
+                     float(inst.pulse.duration),
+                     self._channel_freq_map[inst.channel],
+                     play_phases[play_index],
+                     waveform_ids.setdefault(name, len(waveform_ids))))
+
+        arrays = {}
+        for (con, port), rows in port_rows.items():
+            arrays.setdefault(con, {})[port] = np.array(rows, dtype=waveform_dtype)
+        return arrays, list(waveform_ids)
 
-        return inst_dict
+    def to_waveforms(self, init_time=0.0, parameter_values: Optional[Sequence[float]] = None):
+        """
+        the pulses played by the circuit in the format of the QUA simulator, see `to_waveform_arrays`
+        """
+        arrays, waveform_names = self.to_waveform_arrays(init_time, parameter_values)
+        return {con: {str(port): [{'duration': duration,
+                                   'frequency': frequency,
+                                   'phase': phase,
+                                   'timestamp': timestamp,
+                                   'name': waveform_names[waveform_id]}
+                                  for timestamp, duration, frequency, phase, waveform_id in array.tolist()]
+                      for port, array in port_arrays.items()}
+                for con, port_arrays in arrays.items()}
 
     def to_qua(self):
-        schedule = self._schedule
-        ops_by_chan = CircuitQuaTransformer._ops_by_chan(schedule)
-        num_measure = len([key for key in ops_by_chan.keys() if isinstance(key, MeasureChannel)])
+        """
+        the QUA program as python source, mostly for debugging. use `get_qua_prog_obj` to get the program itself
+        """
+        return self.to_ir().to_qua()
 
-        qua_str = write_indent_line("with program() as prog:")
-        qua_str += write_indent_line(f"I = [None] * {num_measure}", 1)
-        for i in range(num_measure):
-            qua_str += write_indent_line(f"I[{i}] = declare(fixed)", 1)
-        qua_str += write_indent_line(
-            f"align(*{[chan.name for chan in schedule.channels if type(chan) in _play_channels]})",
-            1)
-        qua_str = self._create_qua_body(qua_str)
-        return qua_str
+    def get_qua_prog_obj(self, args=None):
+        """
+        the QUA program, built by calling the QUA API directly while walking the schedule
+
+        :param args: a QUA fixed array with the values of `parameters`, e.g. randomized inside the program. when not
+                     given, an array is declared (with zero values) for a circuit with unbound parameters
+        """
+        return self.to_ir().get_qua_prog_obj(args)
+
+    def to_ir(self, with_config_fragment: bool = False) -> 'QuaProgramIR':
+        """
+        the picklable part of the transformation, which is all that is needed to build the program
+        """
+        return QuaProgramIR(qua_ops=self._get_qua_ops(),
+                            num_measure=self._num_measure(),
+                            play_elements=self._play_elements(),
+                            num_parameters=len(self.parameters),
+                            config_fragment=self.config_fragment() if with_config_fragment else None)
+
+    def _num_measure(self):
+        return len([chan for chan in self._schedule.channels if isinstance(chan, MeasureChannel)])
+
+    def _play_elements(self):
+        return [chan.name for chan in self._schedule.channels if type(chan) in _play_channels]
 
     def _create_qua_body(self, qua_str):
+        return qua_str + render_qua_ops(self._get_qua_ops())
+
+    def _get_qua_ops(self):
+        if self._qua_ops is None:
+            self._qua_ops = self._schedule_to_qua_ops()
+            if self._compact:
+                self._qua_ops = compact_qua_ops(self._qua_ops)
+        return self._qua_ops
+
+    def _schedule_to_qua_ops(self):
+        """
+        walk the schedule once and list its QUA statements in program order, as tuples of the statement name and its
+        arguments: ('frame_rotation', phase, element) where phase is a float or a `ParametricPhase`,
+        ('wait', cycles, element), ('play', operation, element) and ('measure', element, result index)
+        """
         schedule = self._schedule
         inst_seq = schedule.instructions
         current_time_map = {chan: 0 for chan in schedule.channels}
+        qua_ops = []
         for inst_tuple in inst_seq:
             start_time, inst = inst_tuple
             if isinstance(inst, ShiftPhase):
-                qua_str += write_indent_line(f"frame_rotation({inst.phase}, '{inst.channel.name}')", 1)
-                # qua_str += write_indent_line(f"frame_rotation(args, '{inst.channel.name}')", 1)
+                qua_ops.append(('frame_rotation', self._to_phase(inst.phase), inst.channel.name))
             elif isinstance(inst, Play):
                 if start_time > current_time_map[inst.channel]:
                     wait_time = (start_time - current_time_map[inst.channel])
-                    qua_str += write_indent_line(f"wait({wait_time // 4},"
-                                                 f"'{inst.channel.name}')", 1)
+                    qua_ops.append(('wait', wait_time // 4, inst.channel.name))
                 else:
                     wait_time = 0
                 current_time_map[inst.channel] += inst.duration + wait_time
                 if isinstance(inst.channel, MeasureChannel):
-                    qua_str += write_indent_line(
-                        f"measure('test_pulse_1', '{inst.channel.name}', None, "  # todo: this is hardcoded, fix
-                        f"('integw', I[{inst.channel.index}]))", 1)
-                    qua_str += write_indent_line(f"save(I[{inst.channel.index}], 'I{inst.channel.index}')", 1)
+                    qua_ops.append(('measure', inst.channel.name, inst.channel.index))
                 else:
-                    qua_str += write_indent_line(f"play('{inst.name}', '{inst.channel.name}')", 1)
+                    qua_ops.append(('play', inst.name, inst.channel.name))
 
             elif isinstance(inst, Barrier):
                 pass
@@ -161,51 +333,315 @@ class CircuitQuaTransformer:
                 pass
             else:
                 raise ValueError(f"unknown instruction type {inst}")
-        return qua_str
+        return qua_ops
 
-    def _to_config(self):
-        schedule = self._circuit_to_schedule(self._circuit)
+    def config_fragment(self):
+        """
+        the parts of the config this circuit adds to `config_base`: the operations of every drive and control element
+        and the pulses and waveforms they play
+        """
+        schedule = self._schedule
         chan_filter = []
         for i in range(self._circuit.num_qubits):
             chan_filter.append(DriveChannel(i))
             chan_filter.append(ControlChannel(i))
         schedule = schedule.filter(channels=chan_filter)
-        pulse_dict = {inst[1].name:
-                          (inst[1].duration,
-                           inst[1].pulse.samples)
-                      for inst in schedule.instructions if isinstance(inst[1], Play)
-                      }
-        config = deepcopy(self._config_base)
-        ops_by_chan = CircuitQuaTransformer._ops_by_chan(schedule)
-        for chan in schedule.channels:
-            if isinstance(chan, DriveChannel) or isinstance(chan, ControlChannel):
-                config['elements'][chan.name]['operations'] = {value: value + '_in' for value in ops_by_chan[chan]}
-        config['pulses'].update({pulse_name + '_in': {
-            'operation': 'control',
-            'length': pulse_dict[pulse_name][0],
-            'waveforms': {
-                'I': pulse_name + '_i',
-                'Q': pulse_name + '_q',
-
+        operations = {chan.name: {} for chan in schedule.channels
+                      if isinstance(chan, DriveChannel) or isinstance(chan, ControlChannel)}
+        pulses = {}
+        waveforms = {}
+        for _, inst in schedule.instructions:
+            if not isinstance(inst, Play):
+                continue
+            (name_i, waveform_i), (name_q, waveform_q) = self._play_waveforms(inst)
+            waveforms[name_i] = waveform_i
+            waveforms[name_q] = waveform_q
+            pulse_name = f"pulse_{hashlib.sha1(f'{inst.duration},{name_i},{name_q}'.encode()).hexdigest()[:16]}"
+            pulses[pulse_name] = {
+                'operation': 'control',
+                'length': inst.duration,
+                'waveforms': {
+                    'I': name_i,
+                    'Q': name_q,
+                }
             }
+            element_ops = operations[inst.channel.name]
+            if element_ops.setdefault(inst.name, pulse_name) != pulse_name:
+                raise ValueError(f"operation '{inst.name}' plays different pulses on '{inst.channel.name}'")
+        return {'operations': operations, 'pulses': pulses, 'waveforms': waveforms}
+
+    def _to_config(self):
+        return merge_config_fragments(self._config_base, [self.config_fragment()])
+
+
+@dataclass
+class QuaProgramIR:
+    """
+    the QUA statements of a transformed circuit (see `CircuitQuaTransformer._schedule_to_qua_ops`) and what the
+    program around them needs. unlike the transformer it holds no qiskit objects, so it can be sent between processes
+    """
+    qua_ops: list
+    num_measure: int
+    play_elements: List[str]
+    num_parameters: int = 0
+    config_fragment: Optional[dict] = None
+
+    def to_qua(self) -> str:
+        """
+        the QUA program as python source
+        """
+        qua_str = write_indent_line("with program() as prog:")
+        qua_str += write_indent_line(f"I = [None] * {self.num_measure}", 1)
+        for i in range(self.num_measure):
+            qua_str += write_indent_line(f"I[{i}] = declare(fixed)", 1)
+        if self.num_parameters:
+            qua_str += write_indent_line(f"args = declare(fixed, size={self.num_parameters})", 1)
+        qua_str += write_indent_line(f"align(*{self.play_elements})", 1)
+        qua_str += render_qua_ops(self.qua_ops)
+        return qua_str
+
+    def get_qua_prog_obj(self, args=None):
+        """
+        the QUA program, see `CircuitQuaTransformer.get_qua_prog_obj`
+        """
+        from qm.qua import program, declare, fixed, align
+
+        with program() as prog:
+            I = [declare(fixed) for _ in range(self.num_measure)]
+            if args is None and self.num_parameters:
+                args = declare(fixed, size=self.num_parameters)
+            align(*self.play_elements)
+            emit_qua_ops(self.qua_ops, I, args)
+        return prog
+
+
+def _wrap_phase(phase):
+    # into [-pi, pi), frame rotations are only defined modulo 2 pi
+    return (phase + np.pi) % (2 * np.pi) - np.pi
+
+
+def _is_zero_phase(phase):
+    return np.isclose(phase, 0.0, rtol=0.0, atol=1e-12) or np.isclose(abs(phase), 2 * np.pi, rtol=0.0, atol=1e-12)
+
+
+def compact_qua_ops(qua_ops):
+    """
+    remove the redundant real time instructions of a list of QUA statements, see
+    `CircuitQuaTransformer._schedule_to_qua_ops`, without changing what is played
+
+    every element runs its statements in order and independently of the other elements, so per element the frame
+    rotations between two pulses are folded (modulo 2 pi) into a single rotation that is emitted right before the next
+    pulse, adjacent waits are merged and zero waits and rotations are dropped. rotations and waits after the last
+    pulse of an element are kept, as they affect whatever is played next
+
+    rotations that depend on the circuit parameters are emitted as they are: QUA evaluates them in fixed point, in
+    [-8, 8), so a sum of several of them could overflow where each one alone does not
+    """
+    compacted = []
+    pending_phase = {}
+    pending_wait = {}
+
+    def flush(element):
+        if pending_wait.get(element, 0) > 0:
+            compacted.append(('wait', pending_wait[element], element))
+        phase = _wrap_phase(pending_phase.get(element, 0.0))
+        if not _is_zero_phase(phase):
+            compacted.append(('frame_rotation', phase, element))
+        pending_wait[element] = 0
+        pending_phase[element] = 0.0
+
+    for qua_op in qua_ops:
+        if qua_op[0] == 'frame_rotation' and isinstance(qua_op[1], ParametricPhase):
+            compacted.append(qua_op)
+        elif qua_op[0] == 'frame_rotation':
+            pending_phase[qua_op[2]] = pending_phase.get(qua_op[2], 0.0) + qua_op[1]
+        elif qua_op[0] == 'wait':
+            pending_wait[qua_op[2]] = pending_wait.get(qua_op[2], 0) + qua_op[1]
+        elif qua_op[0] == 'play':
+            flush(qua_op[2])
+            compacted.append(qua_op)
+        elif qua_op[0] == 'measure':
+            flush(qua_op[1])
+            compacted.append(qua_op)
+        else:
+            raise ValueError(f"unknown QUA statement {qua_op}")
+    for element in list(pending_phase) + list(pending_wait):
+        flush(element)
+    return compacted
+
+
+def render_qua_ops(qua_ops, level=1) -> str:
+    """
+    python source of a list of QUA statements, see `CircuitQuaTransformer._schedule_to_qua_ops`
+    """
+    lines = []
+    for qua_op in qua_ops:
+        if qua_op[0] == 'frame_rotation':
+            phase = qua_op[1].to_qua_str() if isinstance(qua_op[1], ParametricPhase) else qua_op[1]
+            lines.append(f"frame_rotation({phase}, '{qua_op[2]}')")
+        elif qua_op[0] == 'wait':
+            lines.append(f"wait({qua_op[1]},'{qua_op[2]}')")
+        elif qua_op[0] == 'play':
+            lines.append(f"play('{qua_op[1]}', '{qua_op[2]}')")
+        elif qua_op[0] == 'measure':
+            lines.append(f"measure('{measure_operation}', '{qua_op[1]}', None, ('integw', I[{qua_op[2]}]))")
+            lines.append(f"save(I[{qua_op[2]}], 'I{qua_op[2]}')")
+        else:
+            raise ValueError(f"unknown QUA statement {qua_op}")
+    return ''.join(write_indent_line(line, level) for line in lines)
+
+
+def emit_qua_ops(qua_ops, I, args=None):
+    """
+    call the QUA API for a list of QUA statements, inside a `program()` context
+
+    :param I: the fixed variables that the measurement results are saved to
+    :param args: the QUA fixed array that parametric phases are read from
+    """
+    from qm.qua import frame_rotation, wait, play, measure, save
+
+    for qua_op in qua_ops:
+        if qua_op[0] == 'frame_rotation':
+            phase = qua_op[1].to_qua(args) if isinstance(qua_op[1], ParametricPhase) else qua_op[1]
+            frame_rotation(phase, qua_op[2])
+        elif qua_op[0] == 'wait':
+            wait(qua_op[1], qua_op[2])
+        elif qua_op[0] == 'play':
+            play(qua_op[1], qua_op[2])
+        elif qua_op[0] == 'measure':
+            measure(measure_operation, qua_op[1], None, ('integw', I[qua_op[2]]))
+            save(I[qua_op[2]], f'I{qua_op[2]}')
+        else:
+            raise ValueError(f"unknown QUA statement {qua_op}")
+
+
+def merge_config_fragments(config_base: dict, fragments: List[dict]) -> dict:
+    """
+    a single config with the pulses and waveforms of all the fragments, see `CircuitQuaTransformer.config_fragment`
+
+    the operations of an element are the union of its operations in all fragments. pulses and waveforms are named by
+    their content, so the ones that appear in several fragments are added once. an operation or a name that refers to
+    different pulses or waveforms raises a ValueError
+    """
+    config = deepcopy(config_base)
+    operations = {}
+    for fragment in fragments:
+        for element, element_ops in fragment['operations'].items():
+            merged_ops = operations.setdefault(element, {})
+            for operation, pulse_name in element_ops.items():
+                if merged_ops.setdefault(operation, pulse_name) != pulse_name:
+                    raise ValueError(f"operation '{operation}' plays different pulses on '{element}' in different "
+                                     f"circuits")
+        for key in ('pulses', 'waveforms'):
+            for name, value in fragment[key].items():
+                if name in config[key] and config[key][name] != value:
+                    raise ValueError(f"{key[:-1]} '{name}' has different definitions in different circuits")
+                config[key][name] = value
+    for element, element_ops in operations.items():
+        config['elements'][element]['operations'] = element_ops
+    return config
+
+
+class BatchCircuitQuaTransformer:
+    """
+    transform a family of circuits (e.g. the RB or QV circuits of an experiment) with a single shared config, so that
+    the QM is opened once and every circuit runs on it
+    """
+
+    def __init__(self,
+                 pulse_backend: PulseBackend,
+                 config_base: dict,
+                 circuits: List[QuantumCircuit],
+                 cache_schedule: bool = False):
+        self.transformers = [CircuitQuaTransformer(pulse_backend, config_base, circuit, cache_schedule=cache_schedule)
+                             for circuit in circuits]
+        self.config = merge_config_fragments(config_base,
+                                             [transformer.config_fragment() for transformer in self.transformers])
+
+    def __len__(self):
+        return len(self.transformers)
+
+    def __getitem__(self, index) -> CircuitQuaTransformer:
+        return self.transformers[index]
+
+    def to_qua(self) -> List[str]:
+        """
+        the QUA program of every circuit as python source, all of them run on `config`
+        """
+        return [transformer.to_qua() for transformer in self.transformers]
+
+    def get_qua_prog_objs(self) -> list:
+        """
+        the QUA program of every circuit, all of them run on `config`
+        """
+        return [transformer.get_qua_prog_obj() for transformer in self.transformers]
+
+
+# the arguments of `_transform_circuit` in a worker process of `transform_many`, and the names of the waveforms the
+# worker has sent back so far
+_worker_transform_args = None
+_worker_sent_waveforms = set()
+
+
+def _init_transform_worker(pulse_backend, config_base, transpile_options, cache_schedule, compact):
+    # the backend and its calibrations are sent once per worker, not once per circuit
+    global _worker_transform_args, _worker_sent_waveforms
+    _worker_transform_args = (pulse_backend, config_base, transpile_options, cache_schedule, compact)
+    _worker_sent_waveforms = set()
+
+
+def _transform_circuit(circuit: QuantumCircuit, pulse_backend, config_base, transpile_options, cache_schedule,
+                       compact, sent_waveforms: set) -> Tuple[QuaProgramIR, dict]:
+    # waveforms are named by their content, so the samples of every waveform are returned once, the first time it is
+    # played, and the pulses of the config fragment only refer to it by name. sent_waveforms is updated in place
+    if transpile_options is not None:
+        circuit = transpile(circuit, **transpile_options)
+    transformer = CircuitQuaTransformer(pulse_backend, config_base, circuit, cache_schedule=cache_schedule,
+                                        compact=compact)
+    ir = transformer.to_ir(with_config_fragment=True)
+    waveforms = {name: waveform for name, waveform in ir.config_fragment['waveforms'].items()
+                 if name not in sent_waveforms}
+    sent_waveforms.update(waveforms)
+    ir.config_fragment = dict(ir.config_fragment, waveforms={})
+    return ir, waveforms
 
-        } for pulse_name in pulse_dict.keys()})
 
-        wf_names = set(p + "_i" for p in pulse_dict.keys()).union(set(p + "_q" for p in pulse_dict.keys()))
+def _transform_circuit_in_worker(circuit: QuantumCircuit) -> Tuple[QuaProgramIR, dict]:
+    return _transform_circuit(circuit, *_worker_transform_args, _worker_sent_waveforms)
 
-        config['waveforms'].update({wf_name: {
-            'type': 'arbitrary',
-            'samples': pulse_dict[wf_name[:-2]][1].real.tolist()
-            if wf_name[-1] == 'i'
-            else
-            pulse_dict[wf_name[:-2]][1].imag.tolist()
-        } for wf_name in wf_names})
-        return config
 
-    def get_qua_prog_obj(self, circuit: QuantumCircuit):
-        # todo: not working, probably globals is wrong
-        qua_str = self.to_qua(circuit)
+def transform_many(pulse_backend: PulseBackend,
+                   config_base: dict,
+                   circuits: List[QuantumCircuit],
+                   workers: Optional[int] = None,
+                   transpile_options: Optional[dict] = None,
+                   cache_schedule: bool = False,
+                   compact: bool = True) -> Tuple[dict, List[QuaProgramIR]]:
+    """
+    transform a batch of circuits into one shared config and a program per circuit, like
+    `BatchCircuitQuaTransformer`, optionally in parallel
 
-        ret_dict = {}
-        exec(qua_str, globals(), ret_dict)
-        return ret_dict["prog"]
+    :param workers: if given, the circuits are transpiled, scheduled and transformed in a process pool with this many
+                    workers. only the `QuaProgramIR` of every circuit is sent back, and the samples of every waveform
+                    once per worker
+    :param transpile_options: if given, every circuit is first transpiled with `qiskit.transpile(circuit,
+                              **transpile_options)`, e.g. the basis gates and coupling map of `QVMaker`
+    :return: a tuple (config, irs), the results are in the order of `circuits` whatever the number of workers. the
+             config fragments of the irs hold their operations and pulses, the waveforms are only in config
+    """
+    transform_args = (pulse_backend, config_base, transpile_options, cache_schedule, compact)
+    if workers is None:
+        sent_waveforms = set()
+        results = [_transform_circuit(circuit, *transform_args, sent_waveforms) for circuit in circuits]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_transform_worker,
+                                 initargs=transform_args) as executor:
+            results = list(executor.map(_transform_circuit_in_worker, circuits,
+                                        chunksize=max(1, len(circuits) // (4 * workers))))
+    irs = [ir for ir, _ in results]
+    waveforms = {}
+    for _, ir_waveforms in results:
+        waveforms.update(ir_waveforms)
+    config = merge_config_fragments(config_base, [ir.config_fragment for ir in irs] +
+                                    [{'operations': {}, 'pulses': {}, 'waveforms': dict(sorted(waveforms.items()))}])
+    return config, irs
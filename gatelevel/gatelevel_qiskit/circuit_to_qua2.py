@@ -1,8 +1,10 @@
 import itertools
+from concurrent.futures import ProcessPoolExecutor
 from copy import copy, deepcopy
 from pprint import pprint
+from typing import Optional
 
-from qiskit import schedule as build_schedule, QuantumCircuit
+from qiskit import QuantumCircuit
 from qiskit.circuit import Barrier
 from qiskit.pulse import Play, ShiftPhase, Schedule, Acquire, AcquireChannel, MemorySlot, MeasureChannel, \
     ControlChannel, DriveChannel
@@ -19,15 +21,22 @@ class CircuitQua2Transformer:
     def __init__(self,
                  pulse_backend: PulseBackend,
                  config_base: dict,
-                 circuit: QuantumCircuit):
+                 circuit: QuantumCircuit,
+                 cache_schedule: bool = False):
+        """
+        :param cache_schedule: reuse the schedule of a structurally identical circuit transformed before with the same
+                               pulse backend, see `PulseBackend.build_schedule`
+        """
         self._circuit = circuit
+        self._cache_schedule = cache_schedule
         self._channel_port_map = CircuitQua2Transformer._create_channel_port_map(config_base)
         self._channel_osc_map = CircuitQua2Transformer._create_chan_freq_map(config_base)
         self._config_base = config_base
         self._pulse_backend = pulse_backend
-        self.config = self._to_config()
+        # the circuit is scheduled once, the config and the QUA code are both generated from this schedule
         self._pulse_backend.add_measure_pulses(config_base)
         self._schedule = self._circuit_to_schedule(circuit)
+        self.config = self._to_config()
 
     @staticmethod
     def _create_channel_port_map(config_base):
@@ -53,8 +62,7 @@ class CircuitQua2Transformer:
         return ch_osc_map
 
     def _circuit_to_schedule(self, circuit: QuantumCircuit):
-        return build_schedule(circuit, self._pulse_backend.backend,
-                              inst_map=self._pulse_backend.instruction_schedule_map)
+        return self._pulse_backend.build_schedule(circuit, use_cache=self._cache_schedule)
 
     def _channel_to_port(self, channel, quad):
         return self._channel_port_map[channel.name + "_" + quad]
@@ -67,60 +75,50 @@ class CircuitQua2Transformer:
                 chans_pulse_dict[inst[1].channel].add(inst[1].name)
         return chans_pulse_dict
 
-    def to_qua(self):
+    def to_qua(self, workers: Optional[int] = None):
+        """
+        :param workers: if given, the do() blocks of the channels are rendered in a process pool with this many
+                        workers, for devices with many channels
+        """
         schedule = self._schedule
-        ops_by_chan = CircuitQua2Transformer._ops_by_chan(schedule)
-        num_measure = len([key for key in ops_by_chan.keys() if isinstance(key, MeasureChannel)])
-
-        channel_schedules = [schedule.filter(channels=[chan]) for chan in schedule.channels if
-                             isinstance(chan, PulseChannel)]
+        # a single pass over the schedule, which buckets the instructions of every pulse channel into its timeline
+        channels = [chan for chan in schedule.channels if isinstance(chan, PulseChannel)]
+        timelines = {chan: [] for chan in channels}
+        for start_time, inst in schedule.instructions:
+            for chan in inst.channels:
+                if chan in timelines:
+                    timelines[chan].append(self._timeline_entry(start_time, inst))
+
+        render_args = [(chan_index, chan.name, timelines[chan]) for chan_index, chan in enumerate(channels)]
+        if workers is None:
+            channel_blocks = [_render_channel(*args) for args in render_args]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                channel_blocks = list(executor.map(_render_channel, *zip(*render_args)))
 
         qua_str = ""
         qua_str += write_indent_line("deterministic:")
-        qua_str = write_indent_line("no_gaps:", 1)
+        qua_str += write_indent_line("no_gaps:", 1)
         qua_str += write_indent_line("parallel:", 2)
-        for chan_index, channel_schedule in enumerate(channel_schedules):
-            qua_str += write_indent_line(f"do('{channel_schedule.channels[0].name}'):", 3)
-            inst_seq = channel_schedule.instructions
-
-            current_time = 0
-
-            for inst_tuple in inst_seq:
-                start_time, inst = inst_tuple
-                if isinstance(inst, ShiftPhase):
-                    qua_str += write_indent_line(f"frame_rotation_2pi(phase={inst.phase / (2 * np.pi)},"
-                                                 f"frame={chan_index})", 4)
-                elif isinstance(inst, Play):
-                    if start_time > current_time:
-                        wait_time = start_time - current_time
-                        qua_str += write_indent_line(f"wait({wait_time // 4})", 4)
-                    else:
-                        wait_time = 0
-                    current_time += inst.duration + wait_time
-                    ports = [f"(con1, {self._channel_port_map[inst.channel.name + '_' + quad]})" for quad in 'iq']
-                    if isinstance(inst.channel, MeasureChannel):
-                        qua_str += write_indent_line(
-                            f"measure('test_pulse_1', "
-                            f"oscillator={self._channel_osc_map[inst.channel]},"
-                            f"frame={chan_index}, "
-                            f"port={ports}, "  # todo: this is hardcoded, fix
-                            f"('integw', I[{inst.channel.index}]))", 4)
-                    else:
-                        qua_str += write_indent_line(f"play('{inst.name}', "
-                                                     f"oscillator={self._channel_osc_map[inst.channel]}, "
-                                                     f"frame={chan_index}, "
-                                                     f"port={ports})", 4)
-
-                elif isinstance(inst, Barrier):
-                    pass  # this will probably require going outside of strict timing
-                elif isinstance(inst, Acquire):
-                    pass
-                else:
-                    raise ValueError(f"unknown instruction type {inst}")
-        return qua_str
+        return qua_str + "".join(channel_blocks)
+
+    def _timeline_entry(self, start_time, inst):
+        # the instruction as plain data, so a channel can be rendered in another process
+        if isinstance(inst, ShiftPhase):
+            return 'shift_phase', start_time, inst.phase
+        elif isinstance(inst, Play):
+            ports = [f"(con1, {self._channel_port_map[inst.channel.name + '_' + quad]})" for quad in 'iq']
+            return 'play', start_time, inst.duration, inst.name, isinstance(inst.channel, MeasureChannel), \
+                   inst.channel.index, self._channel_osc_map[inst.channel], ports
+        elif isinstance(inst, Barrier):
+            return 'barrier', start_time  # this will probably require going outside of strict timing
+        elif isinstance(inst, Acquire):
+            return 'acquire', start_time
+        else:
+            raise ValueError(f"unknown instruction type {inst}")
 
     def _to_config(self):
-        schedule = self._circuit_to_schedule(self._circuit)
+        schedule = self._schedule
         schedule = schedule.filter(channels=[DriveChannel(0), DriveChannel(1), ControlChannel(0), ControlChannel(1)])
         pulse_dict = {inst[1].name:
                           (inst[1].duration,
@@ -161,3 +159,34 @@ class CircuitQua2Transformer:
         ret_dict = {}
         exec(qua_str, globals(), ret_dict)
         return ret_dict["prog"]
+
+
+def _render_channel(chan_index, chan_name, timeline):
+    # the do() block of a single channel, see `CircuitQua2Transformer._timeline_entry` for the timeline entries
+    lines = [write_indent_line(f"do('{chan_name}'):", 3)]
+    current_time = 0
+    for entry in timeline:
+        if entry[0] == 'shift_phase':
+            lines.append(write_indent_line(f"frame_rotation_2pi(phase={entry[2] / (2 * np.pi)},"
+                                           f"frame={chan_index})", 4))
+        elif entry[0] == 'play':
+            _, start_time, duration, name, is_measure, index, oscillator, ports = entry
+            if start_time > current_time:
+                wait_time = start_time - current_time
+                lines.append(write_indent_line(f"wait({wait_time // 4})", 4))
+            else:
+                wait_time = 0
+            current_time += duration + wait_time
+            if is_measure:
+                lines.append(write_indent_line(
+                    f"measure('test_pulse_1', "
+                    f"oscillator={oscillator},"
+                    f"frame={chan_index}, "
+                    f"port={ports}, "  # todo: this is hardcoded, fix
+                    f"('integw', I[{index}]))", 4))
+            else:
+                lines.append(write_indent_line(f"play('{name}', "
+                                               f"oscillator={oscillator}, "
+                                               f"frame={chan_index}, "
+                                               f"port={ports})", 4))
+    return "".join(lines)
@@ -1,45 +1,159 @@
-import importlib
+import hashlib
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
 
 # Import Qiskit classes
 import qiskit
+from qiskit.circuit import Parameter
 # Import the qv function
-from qiskit.circuit.library import QuantumVolume
+from qiskit.circuit.library import QuantumVolume, U1Gate
 
-from gatelevel_qiskit.circuit_to_qua import CircuitQuaTransformer
+from gatelevel_qiskit.circuit_to_qua import CircuitQuaTransformer, emit_qua_ops
 from gatelevel_qiskit.examples.qv_config import config_base, num_qubits
-from gatelevel_qiskit.lib import write_indent_line
+from gatelevel_qiskit.lib import atomic_path, write_indent_line
+from gatelevel_qiskit.pulse_backend import circuit_hash
 from gatelevel_qiskit.simple_backend import simple_backend, qubit_coupling_map
 
+qv_basis_gates = ['u1', 'sx', 'cx']
+
+# transpiled QV templates, in memory and pickled on disk, keyed by `_template_key`
+_templates_dir = os.environ.get('QV_TEMPLATES_DIR',
+                                os.path.join(os.path.expanduser('~'), '.cache', 'gatelevel_qiskit', 'qv_templates'))
+_templates = {}
+# circuit hash -> QUA macro
+_qv_macros = {}
+# the parameters of parametric QV circuits, in the order of the args array of their macros. they are shared by all
+# the circuits, so that circuits of the same template hash the same
+qv_parameters = [Parameter(f"qv_{index:02d}") for index in range(3 * num_qubits)]
+
+
+def _template_key(num_qubits, depth, seed, coupling_map, basis_gates):
+    # the transpiler output changes between qiskit versions
+    return (qiskit.__version__, num_qubits, depth, seed, tuple(tuple(pair) for pair in coupling_map),
+            tuple(basis_gates))
+
+
+def _template_path(key):
+    return os.path.join(_templates_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.pickle')
+
+
+def _transpile_qv(num_qubits, depth, seed, coupling_map, basis_gates):
+    qvc = QuantumVolume(num_qubits, depth=depth, seed=seed, classical_permutation=False)
+    return qiskit.compiler.transpile(qvc,
+                                     basis_gates=basis_gates,
+                                     coupling_map=coupling_map,
+                                     optimization_level=3,
+                                     seed_transpiler=seed)
+
+
+def get_qv_template(num_qubits: int, depth: int, seed: Optional[int] = None, coupling_map=None,
+                    basis_gates=None) -> qiskit.QuantumCircuit:
+    """
+    a transpiled QV circuit. circuits with a seed are templates: they are transpiled once and then loaded from the
+    in memory cache or from the pickle of an earlier run. every call returns a copy of the template, which the caller
+    is free to modify
+    """
+    coupling_map = qubit_coupling_map if coupling_map is None else coupling_map
+    basis_gates = qv_basis_gates if basis_gates is None else basis_gates
+    if seed is None:
+        return _transpile_qv(num_qubits, depth, seed, coupling_map, basis_gates)
+
+    key = _template_key(num_qubits, depth, seed, coupling_map, basis_gates)
+    if key not in _templates:
+        path = _template_path(key)
+        if os.path.exists(path):
+            with open(path, 'rb') as template_file:
+                _templates[key] = pickle.load(template_file)
+        else:
+            _templates[key] = _transpile_qv(num_qubits, depth, seed, coupling_map, basis_gates)
+            with atomic_path(path) as tmp_path, open(tmp_path, 'wb') as tmp_file:
+                pickle.dump(_templates[key], tmp_file)
+    return _templates[key].copy()
 
-class QVMaker(CircuitQuaTransformer):
-    def __init__(self):  # todo: generate config for number of qubits instead of making it hard coded and imported
-        qvc = QuantumVolume(num_qubits, depth=num_qubits, classical_permutation=False)
 
-        qcvt = qiskit.compiler.transpile(qvc,
-                                         basis_gates=['u1', 'sx', 'cx'],
-                                         coupling_map=qubit_coupling_map,
-                                         optimization_level=3)
+def parametrize_qv_circuit(circuit: qiskit.QuantumCircuit) -> qiskit.QuantumCircuit:
+    """
+    a copy of a transpiled QV circuit where the angle of every u1 gate is shifted by one of `qv_parameters`, in turn.
+    with all the parameters 0 it is the original circuit
+    """
+    parametric = qiskit.QuantumCircuit(*circuit.qregs, *circuit.cregs, name=circuit.name)
+    num_u1 = 0
+    for inst, qargs, cargs in circuit.data:
+        if inst.name == 'u1':
+            inst = U1Gate(inst.params[0] + qv_parameters[num_u1 % len(qv_parameters)])
+            num_u1 += 1
+        parametric.append(inst, qargs, cargs)
+    return parametric
 
-        super().__init__(simple_backend, config_base, qcvt)
+
+def prebuild_qv_templates(seeds: List[int], num_qubits: int = num_qubits, depth: Optional[int] = None,
+                          workers: Optional[int] = None) -> List[qiskit.QuantumCircuit]:
+    """
+    transpile the QV templates of all the seeds up front, so that building the programs does not transpile
+
+    :param workers: if given, the missing templates are transpiled in a process pool with this many workers
+    """
+    depth = num_qubits if depth is None else depth
+    if workers is not None:
+        missing = [seed for seed in seeds if not os.path.exists(
+            _template_path(_template_key(num_qubits, depth, seed, qubit_coupling_map, qv_basis_gates)))]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # the workers write the pickles, which are then loaded here
+            list(executor.map(get_qv_template, [num_qubits] * len(missing), [depth] * len(missing), missing))
+    return [get_qv_template(num_qubits, depth, seed) for seed in seeds]
+
+
+class QVMaker(CircuitQuaTransformer):
+    def __init__(self, seed: Optional[int] = None, depth: Optional[int] = None, parametric: bool = False):
+        """
+        :param seed: the seed of the QV circuit. with a seed the transpiled circuit is a cached template, see
+                     `get_qv_template`
+        :param depth: the depth of the QV circuit, the number of qubits by default
+        :param parametric: shift the u1 angles by `qv_parameters` (see `parametrize_qv_circuit`), so the macro reads
+                           them from its args array and a single program serves every parameter instance
+        """
+        # todo: generate config for number of qubits instead of making it hard coded and imported
+        qcvt = get_qv_template(num_qubits, num_qubits if depth is None else depth, seed)
+        if parametric:
+            qcvt = parametrize_qv_circuit(qcvt)
+
+        super().__init__(simple_backend, config_base, qcvt, cache_schedule=seed is not None,
+                         parameters=qv_parameters if parametric else None)
 
     def make_qv_macro(self):
+        """
+        the QUA macro of the circuit, a callable macro(args) to be called inside a program, where args is the QUA
+        fixed array of the circuit parameters. macros are cached by circuit hash
+        """
+        key = circuit_hash(self._circuit)
+        if key not in _qv_macros:
+            ir = self.to_ir()
+
+            def macro(args):
+                from qm.qua import align, declare, fixed
+
+                I = [declare(fixed) for _ in range(ir.num_measure)]
+                align()
+                emit_qua_ops(ir.qua_ops, I, args)
+                align()
+
+            _qv_macros[key] = macro
+        return _qv_macros[key]
+
+    def make_qv_macro_str(self):
+        """
+        the source of the QUA macro of `make_qv_macro`, for debugging
+        """
         py_str = ""
         py_str += write_indent_line("from qm.qua import *", 0)
         py_str += write_indent_line("def macro(args):", 0)
+        py_str += write_indent_line(f"I = [declare(fixed) for _ in range({self._num_measure()})]", 1)
         py_str += write_indent_line("align()", 1)
-        py_str += self._create_qua_body(py_str)
+        py_str = self._create_qua_body(py_str)
         py_str += write_indent_line("align()", 1)
-
-        # fl = tempfile.NamedTemporaryFile(mode='w', suffix='.py', dir='.')
-        filename = 'tttt'
-        with open(filename + '.py', 'w') as fl:
-            fl.writelines(py_str)
-        importlib.invalidate_caches()
-        # importname = fl.name.split('/')[-1].split('.')[0]
-        importname = filename
-        myfile = importlib.import_module(importname)
-        # myfile.my_macro()
-        return myfile.__dict__["macro"]
+        return py_str
 
 
 if __name__ == "__main__":
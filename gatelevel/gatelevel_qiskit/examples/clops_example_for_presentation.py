@@ -1,3 +1,4 @@
+import os
 import time
 
 import numpy as np
@@ -5,8 +6,9 @@ from qm import SimulationConfig
 from qm.QuantumMachinesManager import QuantumMachinesManager
 from qm.qua import *
 
-from gatelevel_qiskit.clops_maker import QVMaker
-from gatelevel_qiskit.examples.qv_config import num_qubits
+from gatelevel_qiskit.circuit_to_qua import merge_config_fragments
+from gatelevel_qiskit.clops_maker import QVMaker, prebuild_qv_templates, qv_parameters
+from gatelevel_qiskit.examples.qv_config import config_base, num_qubits
 
 shots = 100
 K = 10
@@ -17,7 +19,7 @@ num_templates_per_prog = 5
 
 def assign_random_parameters(params):
     i = declare(int)
-    with for_(i, 0, i < num_qubits * 3, i + 1):
+    with for_(i, 0, i < len(qv_parameters), i + 1):
         assign(params[i], r.rand_fixed())
         save(params[i], 'xxx')
 
@@ -62,74 +64,85 @@ def bool_to_int(int_result, bool_vector, binary_len):
         assign(int_result, int_result + (Cast.unsafe_cast_int(bool_vector[i_bi]) << i_bi))
 
 
-parameters = []
-
-print('creating programs...')
-progs = []
-for p_i in range(M // num_templates_per_prog):
-    print(f'creating program for circuits {p_i * num_templates_per_prog} to {(p_i + 1) * num_templates_per_prog - 1}')
-    with program() as prog:
-        parameters = declare(fixed, size=num_qubits * 3)
-        qubits_state = declare(bool, size=num_qubits)
-        k = declare(int)  # iteration number
-        n_shots = declare(int)
-        seed = declare(int, value=0)
-        r = lib.Random()
-        r.set_seed(seed)
-        assign_random_parameters(parameters)
-
-        finished = declare(bool, value=False)
-        save(finished, 'finished')
-        for _ in range(num_templates_per_prog):
-            align()
-            with for_(k, 0, k < K, k + 1):
-                with for_(n_shots, 0, n_shots < shots, n_shots + 1):
-                    initialize_qubits()
-                    qvm = QVMaker()
-                    qv_circuit = qvm.make_qv_macro()
-                    qv_circuit(parameters)
-                    measure_state(qubits_state)
-                    bool_to_int(seed, qubits_state, num_qubits)
-                r.set_seed(seed)
-                assign_random_parameters(parameters)
-        assign(finished, True)
-        save(finished, 'finished')
-    progs.append(prog)
-
-qmm = QuantumMachinesManager('172.16.2.149')
-
-# qmm = QuantumMachinesManager(host='oded-36a11cb2.dev.quantum-machines.co', port=443, credentials=create_credentials())
-simulate = False
-if simulate:
-    job = qmm.simulate(qvm.config, prog, SimulationConfig(1200), flags=['auto-element-thread'])
-    job.result_handles.wait_for_all_values()
-else:
-    qm = qmm.open_qm(qvm.config)
-    print('compiling programs...')
-    pids = [qm.compile(progs[i], flags=['auto-element-thread']) for i in range(M // num_templates_per_prog)]
-    print('done.')
-    tic = time.time()
-    for j in range(M // num_templates_per_prog):
-        print(f'starting job for circuits {j * num_templates_per_prog} to {(j + 1) * num_templates_per_prog - 1}')
-        pjob = qm.queue.add_compiled(pids[j])
-        job = pjob.wait_for_execution()
+if __name__ == '__main__':
+    parameters = []
+
+    # the guard keeps the worker processes of prebuild_qv_templates from running the script again
+    print('transpiling templates...')
+    # every template is transpiled once (or loaded from the template cache) and its macro is reused by all the programs
+    prebuild_qv_templates(list(range(M)), workers=os.cpu_count())
+    # the u1 angles of every template are shifted by the randomized parameters, see `parametrize_qv_circuit`
+    qvms = [QVMaker(seed=template, parametric=True) for template in range(M)]
+    qv_circuits = [qvm.make_qv_macro() for qvm in qvms]
+    config = merge_config_fragments(config_base, [qvm.config_fragment() for qvm in qvms])
+
+    print('creating programs...')
+    progs = []
+    for p_i in range(M // num_templates_per_prog):
+        print(f'creating program for circuits {p_i * num_templates_per_prog} to '
+              f'{(p_i + 1) * num_templates_per_prog - 1}')
+        with program() as prog:
+            parameters = declare(fixed, size=len(qv_parameters))
+            qubits_state = declare(bool, size=num_qubits)
+            k = declare(int)  # iteration number
+            n_shots = declare(int)
+            seed = declare(int, value=0)
+            r = lib.Random()
+            r.set_seed(seed)
+            assign_random_parameters(parameters)
+
+            finished = declare(bool, value=False)
+            save(finished, 'finished')
+            for t_i in range(num_templates_per_prog):
+                qv_circuit = qv_circuits[p_i * num_templates_per_prog + t_i]
+                align()
+                with for_(k, 0, k < K, k + 1):
+                    with for_(n_shots, 0, n_shots < shots, n_shots + 1):
+                        initialize_qubits()
+                        qv_circuit(parameters)
+                        measure_state(qubits_state)
+                        bool_to_int(seed, qubits_state, num_qubits)
+                    r.set_seed(seed)
+                    assign_random_parameters(parameters)
+            assign(finished, True)
+            save(finished, 'finished')
+        progs.append(prog)
+
+    qmm = QuantumMachinesManager('172.16.2.149')
+
+    # qmm = QuantumMachinesManager(host='oded-36a11cb2.dev.quantum-machines.co', port=443,
+    #                              credentials=create_credentials())
+    simulate = False
+    if simulate:
+        job = qmm.simulate(config, prog, SimulationConfig(1200), flags=['auto-element-thread'])
         job.result_handles.wait_for_all_values()
-        qs_res = job.result_handles.get('qs').fetch_all()['value']
-        finished_res = job.result_handles.get('finished').fetch_all()
-    toc = time.time() - tic
-    print('total time: ', toc)
-    print('CLOPS:', (K * shots * (M // num_templates_per_prog) * num_templates_per_prog * num_qubits) / toc)
-    print('circuit time + delay time: ',
-          np.diff(finished_res['timestamp']) / 1000 / num_templates_per_prog / n_shots / K,
-          'usec')
-
-# qs_res = job.result_handles.get('qs').fetch_all()['value']
-# seed_res = job.result_handles.get('seed').fetch_all()['value']
-
-if simulate:
-    job.get_simulated_samples().con1.plot()
-    job.get_simulated_samples().con2.plot()
-
-# qs_res = qs_res.reshape((-1, num_qubits))
-# print(qs_res)
-# print(seed_res)
+    else:
+        qm = qmm.open_qm(config)
+        print('compiling programs...')
+        pids = [qm.compile(progs[i], flags=['auto-element-thread']) for i in range(M // num_templates_per_prog)]
+        print('done.')
+        tic = time.time()
+        for j in range(M // num_templates_per_prog):
+            print(f'starting job for circuits {j * num_templates_per_prog} to {(j + 1) * num_templates_per_prog - 1}')
+            pjob = qm.queue.add_compiled(pids[j])
+            job = pjob.wait_for_execution()
+            job.result_handles.wait_for_all_values()
+            qs_res = job.result_handles.get('qs').fetch_all()['value']
+            finished_res = job.result_handles.get('finished').fetch_all()
+        toc = time.time() - tic
+        print('total time: ', toc)
+        print('CLOPS:', (K * shots * (M // num_templates_per_prog) * num_templates_per_prog * num_qubits) / toc)
+        print('circuit time + delay time: ',
+              np.diff(finished_res['timestamp']) / 1000 / num_templates_per_prog / n_shots / K,
+              'usec')
+
+    # qs_res = job.result_handles.get('qs').fetch_all()['value']
+    # seed_res = job.result_handles.get('seed').fetch_all()['value']
+
+    if simulate:
+        job.get_simulated_samples().con1.plot()
+        job.get_simulated_samples().con2.plot()
+
+    # qs_res = qs_res.reshape((-1, num_qubits))
+    # print(qs_res)
+    # print(seed_res)
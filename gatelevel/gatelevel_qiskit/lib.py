@@ -1,7 +1,12 @@
 import importlib
+import os
+import random
+from contextlib import contextmanager
 from copy import deepcopy
 
 from matplotlib import pyplot as plt
+from qiskit import QuantumCircuit
+from qiskit.circuit.library import XGate, HGate, CXGate, YGate, SGate
 from qiskit.pulse import ShiftPhase, Play, Acquire
 
 
@@ -45,3 +50,32 @@ def get_min_time(wfs_data):
         for port in wfs_data[con]:
             mins.append(min(element['timestamp'] for element in wfs_data[con][port]))
     return min(mins)
+
+
+def random_circuit(seed, length=10):
+    """
+    a random 2 qubit circuit of X, Y, H, S and CX gates, as used by the randomized transformer tests
+    """
+    rng = random.Random(seed)
+    gateset = [CXGate(), XGate(), HGate(), YGate(), SGate()]
+    circ = QuantumCircuit(2)
+    for _ in range(length):
+        gate = rng.choice(gateset)
+        circ.append(gate, [0, 1] if isinstance(gate, CXGate) else rng.choice([[0], [1]]))
+    return circ
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    a temporary path to write a file to, which is renamed to path on success, so concurrent readers never see a
+    partial file
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -1,3 +1,5 @@
+import hashlib
+from collections import OrderedDict
 from typing import Union
 from typing import Iterable
 
@@ -6,18 +8,59 @@ from qiskit.pulse import InstructionScheduleMap, Schedule, MeasureChannel, Memor
     Constant
 
 from qiskit import schedule as build_schedule, QuantumCircuit
+from qiskit.circuit import ParameterExpression
+
+
+def _param_key(param):
+    # unbound parameters are told apart by identity, not by name: a schedule holds the `Parameter` objects of the
+    # circuit it was built from, and parameters with the same name from another circuit do not compare equal to them
+    if isinstance(param, ParameterExpression):
+        return str(param), tuple(sorted((parameter.name, hash(parameter)) for parameter in param.parameters))
+    return str(param)
+
+
+def circuit_hash(circuit: QuantumCircuit) -> str:
+    """
+    a hash of the structure of a circuit: the gates, their parameters and the indices of the bits they act on.
+    circuits built separately from the same template have the same hash, unless they have unbound parameters, which
+    only match the same `Parameter` objects
+    """
+    qubit_indices = {qubit: index for index, qubit in enumerate(circuit.qubits)}
+    clbit_indices = {clbit: index for index, clbit in enumerate(circuit.clbits)}
+    digest = hashlib.sha1(f"{circuit.num_qubits},{circuit.num_clbits}".encode())
+    for inst, qargs, cargs in circuit.data:
+        digest.update(repr((inst.name,
+                            tuple(_param_key(param) for param in inst.params),
+                            tuple(qubit_indices[qubit] for qubit in qargs),
+                            tuple(clbit_indices[clbit] for clbit in cargs))).encode())
+    return digest.hexdigest()
 
 
 class PulseBackend:
-    def __init__(self, backend: BaseBackend, instruction_schedule_map: InstructionScheduleMap):
+    def __init__(self, backend: BaseBackend, instruction_schedule_map: InstructionScheduleMap,
+                 schedule_cache_size: int = 128):
         self.backend = backend
         self.instruction_schedule_map = instruction_schedule_map
+        self.schedule_cache_size = schedule_cache_size
+        # LRU of (circuit hash, id of the instruction schedule map) -> schedule. it is cleared when a calibration is
+        # changed through `add`, changes made directly on `instruction_schedule_map` are not tracked
+        self._schedule_cache = OrderedDict()
+
+    def __getstate__(self):
+        # the cached schedules are not sent along to worker processes, see `transform_many`
+        state = self.__dict__.copy()
+        state['_schedule_cache'] = OrderedDict()
+        return state
 
     def add(self,
             instruction: str,
             qubits: Union[int, Iterable[int]],
             schedule: Schedule) -> None:
-        self.instruction_schedule_map.add(instruction, qubits, schedule)
+        ism = self.instruction_schedule_map
+        if ism.has(instruction, qubits) and ism.get(instruction, qubits) == schedule:
+            return  # nothing changed, e.g. the measure pulses are added again by every transformer
+        ism.add(instruction, qubits, schedule)
+        self._schedule_cache.clear()
 
     def add_measure_pulses(self, config_base):
         # todo: currently only constant measurement pulses supported, add arbitrarty
@@ -46,6 +89,23 @@ class PulseBackend:
                         meas_sched += Acquire(waveform_duration, AcquireChannel(channel_index), MemorySlot(channel_index))
             self.add("measure", meas_tuple, meas_sched)
 
-    def build_schedule(self, circuit):
-        return build_schedule(circuit, self.backend,
-                              inst_map=self.instruction_schedule_map)
+    def build_schedule(self, circuit: QuantumCircuit, use_cache: bool = False) -> Schedule:
+        """
+        schedule a circuit with the calibrations of this backend
+
+        :param use_cache: reuse the schedule of a structurally identical circuit scheduled before, see `circuit_hash`.
+                          circuits with their own calibrations are always scheduled, as the hash does not cover them
+        """
+        if not use_cache or circuit.calibrations:
+            return build_schedule(circuit, self.backend,
+                                  inst_map=self.instruction_schedule_map)
+        key = (circuit_hash(circuit), id(self.instruction_schedule_map))
+        if key in self._schedule_cache:
+            self._schedule_cache.move_to_end(key)
+            return self._schedule_cache[key]
+        schedule = build_schedule(circuit, self.backend,
+                                  inst_map=self.instruction_schedule_map)
+        self._schedule_cache[key] = schedule
+        if len(self._schedule_cache) > self.schedule_cache_size:
+            self._schedule_cache.popitem(last=False)
+        return schedule
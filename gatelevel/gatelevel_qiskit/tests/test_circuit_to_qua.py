@@ -1,11 +1,12 @@
 import random
 from pprint import pprint
 
+import numpy as np
 import pytest
 import qiskit
 
 from gatelevel_qiskit.circuit_to_qua import CircuitQuaTransformer
-from gatelevel_qiskit.lib import get_min_time
+from gatelevel_qiskit.lib import get_min_time, random_circuit
 from gatelevel_qiskit.simple_backend import simple_backend
 from gatelevel_qiskit.examples.rb_config import config_base
 from qm.qua import *
@@ -143,3 +144,238 @@ def test_rb_circuit(seed):
     comp = WaveformComparator(wfs_sim, wfs_circ)
     pprint(comp)
     assert len(comp.diff) == 0
+
+
+def test_batch_config():
+    from gatelevel_qiskit.circuit_to_qua import BatchCircuitQuaTransformer
+
+    circs = [random_circuit(seed) for seed in range(5)]
+
+    batch = BatchCircuitQuaTransformer(pulse_backend=simple_backend, config_base=config_base, circuits=circs)
+    assert len(batch) == len(circs)
+    for circ_qua, qua_str in zip(batch, batch.to_qua()):
+        assert qua_str == circ_qua.to_qua()
+        for key in ('pulses', 'waveforms'):
+            for name, value in circ_qua.config[key].items():
+                assert batch.config[key][name] == value
+        for element, element_config in circ_qua.config['elements'].items():
+            assert set(element_config['operations']).issubset(batch.config['elements'][element]['operations'])
+
+    single = BatchCircuitQuaTransformer(pulse_backend=simple_backend, config_base=config_base, circuits=circs[:1])
+    assert single.config == batch[0].config
+
+
+def test_config_waveform_dedup():
+    circ = qiskit.QuantumCircuit(2)
+    circ.x(0)
+    circ.x(1)
+    circ.h(0)
+    circ_qua = CircuitQuaTransformer(pulse_backend=simple_backend,
+                                     config_base=config_base,
+                                     circuit=circ)
+    conf = circ_qua.config
+    # the per qubit 'wf_X' pulses are identical, so they share one pulse and its waveforms
+    assert conf['elements']['d0']['operations']['wf_X'] == conf['elements']['d1']['operations']['wf_X']
+    pulse = conf['pulses'][conf['elements']['d0']['operations']['wf_X']]
+    # the real gaussian has no Q quadrature, which is a constant 0 waveform
+    assert conf['waveforms'][pulse['waveforms']['Q']] == {'type': 'constant', 'sample': 0.0}
+    assert conf['waveforms'][pulse['waveforms']['I']]['type'] == 'arbitrary'
+    # the waveforms reported by `to_waveforms` are the ones of the config
+    wf_names = {inst['name'] for ports in circ_qua.to_waveforms().values() for insts in ports.values()
+                for inst in insts}
+    assert wf_names.issubset(conf['waveforms'])
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_qua_prog_obj(seed):
+    circ_qua = CircuitQuaTransformer(pulse_backend=simple_backend,
+                                     config_base=config_base,
+                                     circuit=random_circuit(seed))
+
+    from qm.QuantumMachinesManager import QuantumMachinesManager
+    from qm import SimulationConfig
+
+    qmm = QuantumMachinesManager()
+    qm = qmm.open_qm(circ_qua.config)
+    job = qm.simulate(circ_qua.get_qua_prog_obj(), SimulationConfig(500, include_analog_waveforms=True))
+    wfs_sim = job.simulated_analog_waveforms()['controllers']['con1']['ports']
+
+    from deepdiff import DeepDiff
+    diff = DeepDiff(wfs_sim, circ_qua.to_waveforms(get_min_time(wfs_sim)), significant_digits=5)
+    pprint(diff)
+    assert len(diff) == 0
+
+
+def test_parametric_frame_rotation():
+    from qiskit.circuit import Parameter
+    from gatelevel_qiskit.circuit_to_qua import ParametricPhase
+
+    theta, phi = Parameter('theta'), Parameter('phi')
+    circ = qiskit.QuantumCircuit(2)
+    circ.u1(theta, 0)
+    circ.x(0)
+    circ.u1(phi, 1)
+    circ.x(1)
+    circ.cx(0, 1)
+    circ_qua = CircuitQuaTransformer(pulse_backend=simple_backend,
+                                     config_base=config_base,
+                                     circuit=circ)
+    assert circ_qua.parameters == [phi, theta]
+    phases = [qua_op[1] for qua_op in circ_qua._get_qua_ops() if qua_op[0] == 'frame_rotation']
+    assert ParametricPhase(0.0, ((1, 1.0),)) in phases
+    assert ParametricPhase(0.0, ((0, 1.0),)) in phases
+    assert "frame_rotation(args[1], 'd0')" in circ_qua.to_qua()
+    with pytest.raises(ValueError):
+        circ_qua.to_waveforms()
+
+    # an explicit order of args, with a parameter the circuit does not use
+    unused = Parameter('unused')
+    ordered_qua = CircuitQuaTransformer(pulse_backend=simple_backend, config_base=config_base, circuit=circ,
+                                       parameters=[unused, theta, phi])
+    assert ordered_qua.to_ir().num_parameters == 3
+    assert "frame_rotation(args[1], 'd0')" in ordered_qua.to_qua()
+    assert "frame_rotation(args[2], 'd1')" in ordered_qua.to_qua()
+    with pytest.raises(ValueError):
+        CircuitQuaTransformer(pulse_backend=simple_backend, config_base=config_base, circuit=circ, parameters=[theta])
+
+    bound_qua = CircuitQuaTransformer(pulse_backend=simple_backend,
+                                      config_base=config_base,
+                                      circuit=circ.bind_parameters({theta: 0.3, phi: -1.1}))
+    assert bound_qua.parameters == []
+    from deepdiff import DeepDiff
+    assert len(DeepDiff(bound_qua.to_waveforms(), circ_qua.to_waveforms(parameter_values=[-1.1, 0.3]),
+                        significant_digits=5)) == 0
+
+
+def test_parametric_phase():
+    from gatelevel_qiskit.circuit_to_qua import ParametricPhase
+
+    phase = ParametricPhase(0.5, ((0, 1.0), (2, -2.0)))
+    assert phase.to_qua_str() == "args[0] + -2.0 * args[2] + 0.5"
+    assert phase.value([1.0, 7.0, 0.25]) == 1.0
+
+
+def test_compact_qua_ops():
+    from gatelevel_qiskit.circuit_to_qua import compact_qua_ops, ParametricPhase
+
+    qua_ops = [
+        ('frame_rotation', np.pi / 2, 'd0'),
+        ('frame_rotation', np.pi / 2, 'u0'),
+        ('frame_rotation', np.pi, 'd0'),
+        ('wait', 0, 'd1'),
+        ('play', 'wf_X', 'd1'),
+        ('frame_rotation', np.pi / 2, 'd0'),
+        ('wait', 3, 'd0'),
+        ('wait', 2, 'd0'),
+        ('play', 'wf_X', 'd0'),
+        ('frame_rotation', ParametricPhase(0.0, ((0, 1.0),)), 'd0'),
+        ('frame_rotation', 0.5, 'd0'),
+        ('play', 'wf_X', 'u0'),
+        ('measure', 'm0', 0),
+        ('frame_rotation', 0.25, 'd1'),
+    ]
+    assert compact_qua_ops(qua_ops) == [
+        ('play', 'wf_X', 'd1'),
+        ('wait', 5, 'd0'),
+        ('play', 'wf_X', 'd0'),
+        ('frame_rotation', ParametricPhase(0.0, ((0, 1.0),)), 'd0'),
+        ('frame_rotation', np.pi / 2, 'u0'),
+        ('play', 'wf_X', 'u0'),
+        ('measure', 'm0', 0),
+        ('frame_rotation', 0.5, 'd0'),
+        ('frame_rotation', 0.25, 'd1'),
+    ]
+    # parametric rotations are not folded, so their fixed point sum cannot overflow
+    parametric = [
+        ('frame_rotation', ParametricPhase(0.0, ((0, 1.0),)), 'd0'),
+        ('frame_rotation', ParametricPhase(0.3, ((0, -1.0),)), 'd0'),
+        ('play', 'wf_X', 'd0'),
+    ]
+    assert compact_qua_ops(parametric) == parametric
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_compact_to_qua(seed):
+    circ = random_circuit(seed, 20)
+    compact = CircuitQuaTransformer(pulse_backend=simple_backend, config_base=config_base, circuit=circ)
+    full = CircuitQuaTransformer(pulse_backend=simple_backend, config_base=config_base, circuit=circ, compact=False)
+    compact_ops, full_ops = compact._get_qua_ops(), full._get_qua_ops()
+    assert len(compact_ops) <= len(full_ops)
+    # the same pulses, in the same order on every element
+    for element in {qua_op[-1] for qua_op in full_ops}:
+        assert [qua_op for qua_op in compact_ops if qua_op[0] == 'play' and qua_op[2] == element] == \
+               [qua_op for qua_op in full_ops if qua_op[0] == 'play' and qua_op[2] == element]
+    assert all(qua_op[1] > 0 for qua_op in compact_ops if qua_op[0] == 'wait')
+
+
+def test_transform_many():
+    from gatelevel_qiskit.circuit_to_qua import BatchCircuitQuaTransformer, transform_many
+
+    circs = [random_circuit(seed) for seed in range(6)]
+
+    batch = BatchCircuitQuaTransformer(pulse_backend=simple_backend, config_base=config_base, circuits=circs)
+    config, irs = transform_many(simple_backend, config_base, circs)
+    parallel_config, parallel_irs = transform_many(simple_backend, config_base, circs, workers=2)
+    assert config == parallel_config == batch.config
+    assert [ir.to_qua() for ir in irs] == [ir.to_qua() for ir in parallel_irs] == batch.to_qua()
+    # the samples are only sent back once, in the merged config
+    assert all(not ir.config_fragment['waveforms'] for ir in irs + parallel_irs)
+
+
+def _reference_waveforms(circ_qua, init_time):
+    # the dict per pulse implementation of `to_waveforms` before the columnar `to_waveform_arrays`
+    from qiskit.pulse import ShiftPhase, Play, MeasureChannel
+
+    inst_dict = {}
+    accumulated_phases = {chan: 0.0 for chan in circ_qua._schedule.channels}
+    for start_time, inst in circ_qua._schedule.instructions:
+        if isinstance(inst, ShiftPhase):
+            accumulated_phases[inst.channel] += inst.phase
+        elif isinstance(inst, Play):
+            phase_wrapped = (accumulated_phases[inst.channel] - np.pi) % (2 * np.pi) - np.pi
+            if phase_wrapped == -np.pi:
+                phase_wrapped = np.pi
+            if isinstance(inst.channel, MeasureChannel):
+                names = (inst.name + "_i", inst.name + "_q")
+            else:
+                (name_i, _), (name_q, _) = circ_qua._play_waveforms(inst)
+                names = (name_i, name_q)
+            for quad, name in zip("iq", names):
+                con, port = circ_qua._channel_to_port(inst.channel, quad)
+                inst_dict.setdefault(con, {}).setdefault(str(port), []).append({
+                    'duration': float(inst.pulse.duration),
+                    'frequency': circ_qua._channel_freq_map[inst.channel],
+                    'phase': phase_wrapped,
+                    'timestamp': float(start_time) + init_time,
+                    'name': name,
+                })
+    return inst_dict
+
+
+def test_waveform_arrays():
+    from gatelevel_qiskit.circuit_to_qua import waveform_dtype
+
+    circ = qiskit.QuantumCircuit(2)
+    circ.x(0)
+    circ.h(1)
+    circ.s(0)
+    circ.cx(0, 1)
+    circ.x(1)
+    circ_qua = CircuitQuaTransformer(pulse_backend=simple_backend,
+                                     config_base=config_base,
+                                     circuit=circ)
+    reference = _reference_waveforms(circ_qua, 100.0)
+    # the adapter reproduces the old output exactly, not only up to the significant digits of the simulator tests
+    assert circ_qua.to_waveforms(100.0) == reference
+
+    arrays, waveform_names = circ_qua.to_waveform_arrays(100.0)
+    assert set(arrays) == set(reference)
+    for con, port_arrays in arrays.items():
+        assert {str(port) for port in port_arrays} == set(reference[con])
+        for port, array in port_arrays.items():
+            expected = reference[con][str(port)]
+            assert array.dtype == waveform_dtype
+            assert array['timestamp'].tolist() == [inst['timestamp'] for inst in expected]
+            assert array['phase'].tolist() == [inst['phase'] for inst in expected]
+            assert [waveform_names[waveform_id] for waveform_id in array['waveform_id']] == \
+                   [inst['name'] for inst in expected]
@@ -0,0 +1,22 @@
+import qiskit
+
+from gatelevel_qiskit.circuit_to_qua2 import CircuitQua2Transformer
+from gatelevel_qiskit.examples.rb_config2 import config_base
+from gatelevel_qiskit.simple_backend import simple_backend
+
+
+def test_to_qua_channel_blocks():
+    circ = qiskit.QuantumCircuit(2)
+    circ.x(0)
+    circ.h(1)
+    circ.s(0)
+    circ.cx(0, 1)
+    circ.x(1)
+    circ_qua = CircuitQua2Transformer(pulse_backend=simple_backend,
+                                      config_base=config_base,
+                                      circuit=circ)
+    qua_str = circ_qua.to_qua()
+    assert qua_str.startswith("deterministic:\n    no_gaps:\n        parallel:\n")
+    for chan in circ_qua._schedule.channels:
+        assert (f"do('{chan.name}'):" in qua_str) == (chan.name[0] in 'dum')
+    assert circ_qua.to_qua(workers=2) == qua_str
@@ -0,0 +1,43 @@
+import os
+
+from gatelevel_qiskit import clops_maker
+from gatelevel_qiskit.circuit_to_qua import ParametricPhase
+from gatelevel_qiskit.pulse_backend import circuit_hash
+
+
+def test_qv_template_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(clops_maker, '_templates_dir', str(tmp_path))
+    monkeypatch.setattr(clops_maker, '_templates', {})
+    template = clops_maker.get_qv_template(3, 3, seed=7)
+    assert len(os.listdir(tmp_path)) == 1
+    # every caller gets its own copy, modifying it leaves the cached template intact
+    copy = clops_maker.get_qv_template(3, 3, seed=7)
+    assert copy is not template and circuit_hash(copy) == circuit_hash(template)
+    copy.x(0)
+    assert circuit_hash(clops_maker.get_qv_template(3, 3, seed=7)) == circuit_hash(template)
+
+    # a new process only has the pickle
+    monkeypatch.setattr(clops_maker, '_templates', {})
+    assert circuit_hash(clops_maker.get_qv_template(3, 3, seed=7)) == circuit_hash(template)
+    assert circuit_hash(clops_maker.get_qv_template(3, 3, seed=8)) != circuit_hash(template)
+
+
+def test_qv_macro_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(clops_maker, '_templates_dir', str(tmp_path))
+    macro = clops_maker.QVMaker(seed=3).make_qv_macro()
+    assert clops_maker.QVMaker(seed=3).make_qv_macro() is macro
+    assert clops_maker.QVMaker(seed=4).make_qv_macro() is not macro
+    assert not os.path.exists('tttt.py')
+
+
+def test_parametric_qv_maker(tmp_path, monkeypatch):
+    monkeypatch.setattr(clops_maker, '_templates_dir', str(tmp_path))
+    qvm = clops_maker.QVMaker(seed=5, parametric=True)
+    assert qvm.parameters == clops_maker.qv_parameters
+    ir = qvm.to_ir()
+    assert ir.num_parameters == len(clops_maker.qv_parameters)
+    assert any(isinstance(qua_op[1], ParametricPhase) for qua_op in ir.qua_ops if qua_op[0] == 'frame_rotation')
+    assert 'args[0]' in qvm.make_qv_macro_str()
+    # the template is parametrized the same way every time, so the macro is still cached
+    assert clops_maker.QVMaker(seed=5, parametric=True).make_qv_macro() is qvm.make_qv_macro()
+    assert clops_maker.QVMaker(seed=5).make_qv_macro() is not qvm.make_qv_macro()
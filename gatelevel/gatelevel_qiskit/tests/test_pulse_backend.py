@@ -0,0 +1,81 @@
+import pickle
+
+import qiskit
+from qiskit.circuit import Parameter
+from qiskit.pulse import Schedule
+
+from gatelevel_qiskit.circuit_to_qua import CircuitQuaTransformer
+from gatelevel_qiskit.examples.rb_config import config_base
+from gatelevel_qiskit.pulse_backend import circuit_hash
+from gatelevel_qiskit.simple_backend import simple_backend
+
+
+def _make_parametric_circuit():
+    circ = qiskit.QuantumCircuit(2)
+    circ.u1(Parameter('theta'), 0)
+    circ.x(0)
+    circ.cx(0, 1)
+    return circ
+
+
+def _make_circuit(angle=0.5):
+    circ = qiskit.QuantumCircuit(2)
+    circ.x(0)
+    circ.h(1)
+    circ.u1(angle, 0)
+    circ.cx(0, 1)
+    return circ
+
+
+def test_circuit_hash():
+    assert circuit_hash(_make_circuit()) == circuit_hash(_make_circuit())
+    assert circuit_hash(_make_circuit()) != circuit_hash(_make_circuit(0.25))
+    swapped = qiskit.QuantumCircuit(2)
+    swapped.x(1)
+    swapped.h(0)
+    swapped.u1(0.5, 1)
+    swapped.cx(1, 0)
+    assert circuit_hash(_make_circuit()) != circuit_hash(swapped)
+
+
+def test_schedule_cache():
+    first = CircuitQuaTransformer(pulse_backend=simple_backend, config_base=config_base, circuit=_make_circuit(),
+                                  cache_schedule=True)
+    second = CircuitQuaTransformer(pulse_backend=simple_backend, config_base=config_base, circuit=_make_circuit(),
+                                   cache_schedule=True)
+    assert second._schedule is first._schedule
+    assert second.config == first.config
+    assert second.to_qua() == first.to_qua()
+
+    uncached = CircuitQuaTransformer(pulse_backend=simple_backend, config_base=config_base, circuit=_make_circuit())
+    assert uncached._schedule is not first._schedule
+    assert uncached.to_qua() == first.to_qua()
+
+
+def test_schedule_cache_calibrations():
+    # same hash, but the calibration of x differs from the backend's
+    calibrated = _make_circuit()
+    calibrated.add_calibration('x', [0], Schedule())
+    assert circuit_hash(calibrated) == circuit_hash(_make_circuit())
+    cached = simple_backend.build_schedule(_make_circuit(), use_cache=True)
+    assert simple_backend.build_schedule(calibrated, use_cache=True) is not cached
+    assert simple_backend.build_schedule(_make_circuit(), use_cache=True) is cached
+
+
+def test_schedule_cache_parameters():
+    # parameters with the same name in separately built circuits are different parameters
+    assert circuit_hash(_make_parametric_circuit()) != circuit_hash(_make_parametric_circuit())
+    template = _make_parametric_circuit()
+    assert circuit_hash(template) == circuit_hash(template.copy())
+    first = CircuitQuaTransformer(pulse_backend=simple_backend, config_base=config_base,
+                                  circuit=_make_parametric_circuit(), cache_schedule=True)
+    second = CircuitQuaTransformer(pulse_backend=simple_backend, config_base=config_base,
+                                   circuit=_make_parametric_circuit(), cache_schedule=True)
+    assert second._schedule is not first._schedule
+    assert second.to_qua() == first.to_qua()
+
+
+def test_pickle_drops_schedule_cache():
+    simple_backend.build_schedule(_make_circuit(), use_cache=True)
+    assert simple_backend._schedule_cache
+    assert not pickle.loads(pickle.dumps(simple_backend))._schedule_cache
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from deepdiff import DeepDiff
+
+from gatelevel_qiskit.circuit_to_qua import CircuitQuaTransformer, QuaProgramIR, ParametricPhase
+from gatelevel_qiskit.examples.rb_config import config_base
+from gatelevel_qiskit.lib import random_circuit
+from gatelevel_qiskit.simple_backend import simple_backend
+from gatelevel_qiskit.timeline_simulator import TimelineSimulator
+
+_config = {
+    'elements': {
+        'd0': {'mixInputs': {'I': ('con1', 1), 'Q': ('con1', 2)}, 'intermediate_frequency': 0.0,
+               'operations': {'x': 'x_in'}},
+        'd1': {'mixInputs': {'I': ('con1', 3), 'Q': ('con1', 4)}, 'intermediate_frequency': 0.0,
+               'operations': {'x': 'x_in'}},
+    },
+    'pulses': {'x_in': {'operation': 'control', 'length': 16, 'waveforms': {'I': 'wf', 'Q': 'zero'}}},
+    'waveforms': {'wf': {'type': 'arbitrary', 'samples': list(np.linspace(0, 1, 16))},
+                  'zero': {'type': 'constant', 'sample': 0.0}},
+}
+
+
+def test_timeline():
+    ir = QuaProgramIR(qua_ops=[('play', 'x', 'd0'),
+                               ('frame_rotation', np.pi / 2, 'd0'),
+                               ('wait', 2, 'd0'),
+                               ('play', 'x', 'd0'),
+                               ('frame_rotation', ParametricPhase(0.0, ((0, 1.0),)), 'd1'),
+                               ('play', 'x', 'd1'),
+                               ('play', 'x', 'd1')],
+                      num_measure=0,
+                      play_elements=['d0', 'd1'],
+                      num_parameters=1)
+    with pytest.raises(ValueError):
+        TimelineSimulator(_config).run(ir)
+    job = TimelineSimulator(_config).run(ir, args=[0.25], start_time=10.0)
+    ports = job.simulated_analog_waveforms()['controllers']['con1']['ports']
+    assert [(inst['timestamp'], inst['phase']) for inst in ports['1']] == [(10.0, 0.0), (34.0, np.pi / 2)]
+    assert [(inst['timestamp'], inst['phase']) for inst in ports['3']] == [(10.0, 0.25), (26.0, 0.25)]
+    assert [inst['name'] for inst in ports['4']] == ['zero', 'zero']
+
+    samples = job.simulated_samples()['con1']
+    assert len(samples['1']) == 50
+    np.testing.assert_allclose(samples['1'][10:26], _config['waveforms']['wf']['samples'])
+    # the second pulse of d0 is rotated by pi / 2 into the Q quadrature
+    np.testing.assert_allclose(samples['2'][34:50], _config['waveforms']['wf']['samples'], atol=1e-12)
+    np.testing.assert_allclose(samples['1'][34:50], 0.0, atol=1e-12)
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_random_circuit(seed):
+    # the offline version of the simulator comparison of test_circuit_to_qua.py
+    circ_qua = CircuitQuaTransformer(pulse_backend=simple_backend,
+                                     config_base=config_base,
+                                     circuit=random_circuit(seed))
+    job = TimelineSimulator(circ_qua.config).run(circ_qua.to_ir(), start_time=232.0)
+    wfs_sim = job.simulated_analog_waveforms()['controllers']['con1']['ports']
+    assert len(DeepDiff(wfs_sim, circ_qua.to_waveforms(232.0), significant_digits=5)) == 0
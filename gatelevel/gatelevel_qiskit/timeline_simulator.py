@@ -0,0 +1,130 @@
+from typing import Optional, Sequence
+
+import numpy as np
+
+from gatelevel_qiskit.circuit_to_qua import ParametricPhase, QuaProgramIR, measure_operation
+
+# a local stand-in for the QM simulator, for the subset of QUA that `CircuitQuaTransformer` emits: play, wait,
+# frame_rotation, measure and save. it only tracks the timing and the frame of every element, so it runs in
+# milliseconds and needs no server, but it does not model the pulse processor or the inputs
+
+
+class TimelineJob:
+    """
+    the result of `TimelineSimulator.run`, with the same `simulated_analog_waveforms` as a simulated `QmJob`
+    """
+
+    def __init__(self, config: dict, pulses: list, saves: list):
+        self._config = config
+        # (timestamp, duration, element, phase, I waveform, Q waveform) of every played pulse
+        self._pulses = pulses
+        # (result name, timestamp) of every save, in program order. the saved values are not simulated
+        self.saves = saves
+
+    def simulated_analog_waveforms(self) -> dict:
+        controllers = {}
+        for timestamp, duration, element, phase, name_i, name_q in sorted(self._pulses, key=lambda pulse: pulse[0]):
+            element_config = self._config['elements'][element]
+            for quad, name in zip('IQ', (name_i, name_q)):
+                con, port = element_config['mixInputs'][quad]
+                ports = controllers.setdefault(con, {'ports': {}})['ports']
+                ports.setdefault(str(port), []).append({'duration': duration,
+                                                        'frequency': element_config['intermediate_frequency'],
+                                                        'phase': phase,
+                                                        'timestamp': timestamp,
+                                                        'name': name})
+        return {'controllers': controllers}
+
+    def simulated_samples(self) -> dict:
+        """
+        the rendered output of every port, one sample per ns from time 0, with ideal up-conversion of the I and Q
+        waveforms of every pulse by its frequency and frame phase
+
+        :return: a dict samples[con][port] of float arrays, with the port as a string as in `simulated_analog_waveforms`
+        """
+        end_time = int(np.ceil(max((pulse[0] + pulse[1] for pulse in self._pulses), default=0.0)))
+        samples = {}
+        for timestamp, duration, element, phase, name_i, name_q in self._pulses:
+            element_config = self._config['elements'][element]
+            (con_i, port_i), (con_q, port_q) = element_config['mixInputs']['I'], element_config['mixInputs']['Q']
+            output_i = samples.setdefault(con_i, {}).setdefault(str(port_i), np.zeros(end_time))
+            output_q = samples.setdefault(con_q, {}).setdefault(str(port_q), np.zeros(end_time))
+            times = np.arange(int(timestamp), int(timestamp) + int(duration))
+            envelope = self._waveform_samples(name_i, duration) + 1j * self._waveform_samples(name_q, duration)
+            output = envelope * np.exp(1j * (2 * np.pi * element_config['intermediate_frequency'] * times * 1e-9 +
+                                             phase))
+            output_i[times] += output.real
+            output_q[times] += output.imag
+        return samples
+
+    def _waveform_samples(self, name, duration):
+        waveform = self._config['waveforms'][name]
+        if waveform['type'] == 'constant':
+            return np.full(int(duration), waveform['sample'])
+        return np.asarray(waveform['samples'], dtype=float)
+
+
+class TimelineSimulator:
+    def __init__(self, config: dict):
+        self.config = config
+
+    def _pulse(self, element, operation):
+        pulse = self.config['pulses'][self.config['elements'][element]['operations'][operation]]
+        return pulse['length'], pulse['waveforms']['I'], pulse['waveforms']['Q']
+
+    def run(self, ir: QuaProgramIR, args: Optional[Sequence[float]] = None, start_time: float = 0.0) -> TimelineJob:
+        """
+        execute the program of a transformed circuit
+
+        :param args: the values of the circuit parameters, required for a program with parametric frame rotations
+        :param start_time: the time of the first instruction, the timestamps of the QM simulator start at the time
+                           it takes to load the program
+        """
+        # the program starts with an align of all the play elements, as in `QuaProgramIR.to_qua`, after which every
+        # element runs its statements independently. so the start time of every statement is a per element cumulative
+        # sum of the durations of the statements before it, and its frame is the cumulative sum of the frame rotations
+        qua_ops = list(ir.qua_ops)
+        element_ids = {}
+        op_elements = np.zeros(len(qua_ops), dtype=int)
+        durations = np.zeros(len(qua_ops))
+        rotations = np.zeros(len(qua_ops))
+        pulses = {}
+        for op_index, qua_op in enumerate(qua_ops):
+            if qua_op[0] not in ('frame_rotation', 'wait', 'play', 'measure'):
+                raise ValueError(f"unknown QUA statement {qua_op}")
+            element = qua_op[1] if qua_op[0] == 'measure' else qua_op[2]
+            op_elements[op_index] = element_ids.setdefault(element, len(element_ids))
+            if qua_op[0] == 'frame_rotation':
+                phase = qua_op[1]
+                if isinstance(phase, ParametricPhase):
+                    if args is None:
+                        raise ValueError("args are required for a program with parametric frame rotations")
+                    phase = phase.value(args)
+                rotations[op_index] = phase
+            elif qua_op[0] == 'wait':
+                durations[op_index] = 4 * qua_op[1]
+            else:
+                operation = qua_op[1] if qua_op[0] == 'play' else measure_operation
+                pulses[op_index] = self._pulse(element, operation)
+                durations[op_index] = pulses[op_index][0]
+
+        starts = np.zeros(len(qua_ops))
+        frames = np.zeros(len(qua_ops))
+        for element_id in range(len(element_ids)):
+            mask = op_elements == element_id
+            ends = start_time + np.cumsum(durations[mask])
+            starts[mask] = ends - durations[mask]
+            frames[mask] = np.cumsum(rotations[mask])
+
+        played = []
+        saves = []
+        for op_index, (length, name_i, name_q) in pulses.items():
+            qua_op = qua_ops[op_index]
+            phase = (frames[op_index] - np.pi) % (2 * np.pi) - np.pi
+            if phase == -np.pi:
+                phase = np.pi  # same convention as `CircuitQuaTransformer.to_waveforms`
+            element = qua_op[1] if qua_op[0] == 'measure' else qua_op[2]
+            played.append((float(starts[op_index]), float(length), element, phase, name_i, name_q))
+            if qua_op[0] == 'measure':
+                saves.append((f'I{qua_op[2]}', float(starts[op_index] + length)))
+        return TimelineJob(self.config, played, saves)
@@ -1,15 +1,22 @@
-from typing import Optional, List
-
-from qiskit import QuantumCircuit, Aer, execute
+import hashlib
+import os
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, List, Union, Tuple
+
+from qiskit import QuantumCircuit
 import qiskit.circuit.library as glib
 import numpy as np
 
 # this builds up on https://arxiv.org/pdf/1402.4848
 # build up sequence
 
-_generate_table = False
-_test_2_design = False  # careful, this takes about 20 minutes
+_test_2_design = False
 size_c2 = 11520
+c2_identity_index = 0
 
 _c1_ops = [
     ('I',),
@@ -117,22 +124,138 @@ def _clifford_to_qiskit_circ(clifford):
     return qc
 
 
-def clifford_to_unitary(gate_seq):
-    qc = _clifford_to_qiskit_circ(gate_seq)
-    simulator = Aer.get_backend("unitary_simulator")
-    unitary: np.ndarray = execute(qc, simulator).result().get_unitary()
+# same matrices and qubit ordering (q0 is the least significant qubit) as the qiskit unitary simulator
+_single_gate_unitaries = {
+    'I': np.eye(2, dtype=complex),
+    'X': np.array([[0, 1], [1, 0]], dtype=complex),
+    'Y': np.array([[0, -1j], [1j, 0]], dtype=complex),
+    'X/2': np.array([[1, -1j], [-1j, 1]], dtype=complex) / np.sqrt(2),
+    'Y/2': np.array([[1, -1], [1, 1]], dtype=complex) / np.sqrt(2),
+    '-X/2': np.array([[1, 1j], [1j, 1]], dtype=complex) / np.sqrt(2),
+    '-Y/2': np.array([[1, 1], [-1, 1]], dtype=complex) / np.sqrt(2),
+}
+_cz_unitary = np.diag([1, 1, 1, -1]).astype(complex)
+
 
+def _ops_to_unitary(ops):
+    unitary = np.eye(2, dtype=complex)
+    for op in ops:
+        unitary = _single_gate_unitaries[op] @ unitary
+    return unitary
+
+
+def clifford_to_unitary(gate_seq):
+    unitary = np.eye(4, dtype=complex)
+    for q0g, q1g in zip(*gate_seq):
+        if q0g == 'cz':
+            unitary = _cz_unitary @ unitary
+        else:
+            unitary = np.kron(_ops_to_unitary(q1g), _ops_to_unitary(q0g)) @ unitary
     return unitary
 
 
-if _generate_table:
-    print('starting...')
-    c2_unitaries = [clifford_to_unitary(index_to_clifford(i)) for i in range(size_c2)]
-    np.savez_compressed('c2_unitaries', c2_unitaries)
-    print('done')
-else:
-    ld = np.load('../raw/c2_unitaries.npz')
-    c2_unitaries = ld['arr_0']
+_c1_unitaries = np.array([_ops_to_unitary(ops) for ops in _c1_ops])
+_s1_unitaries = np.array([_ops_to_unitary(ops) for ops in _s1_ops])
+_s1x2_unitaries = np.array([_ops_to_unitary(ops) for ops in _s1x2_ops])
+_s1y2_unitaries = np.array([_ops_to_unitary(ops) for ops in _s1y2_ops])
+
+
+def _c1_unitary_to_index(unitaries):
+    # phase invariant match against the 24 C1 unitaries, |tr(U_c1^dagger U)| = 2 only for the matching element
+    return np.argmax(np.abs(np.einsum('kij,...ij->...k', _c1_unitaries.conj(), unitaries)), axis=-1)
+
+
+# _c1_mult_table[a, b] is the C1 element _c1_unitaries[a] @ _c1_unitaries[b], i.e. b is applied first
+_c1_mult_table = _c1_unitary_to_index(np.einsum('aij,bjk->abik', _c1_unitaries, _c1_unitaries))
+# the entries of _c1_ops are minimal words in the native alphabet, the identity needs no pulse at all
+_c1_min_ops = [()] + _c1_ops[1:]
+
+
+@lru_cache(maxsize=None)
+def _ops_to_c1_index(ops):
+    return int(_c1_unitary_to_index(_ops_to_unitary(ops)))
+
+
+# the fixed entangling cores of the CNOT, iSWAP and SWAP classes, see index_to_clifford
+_cnot_core = _cz_unitary
+_iswap_core = _cz_unitary @ clifford_to_unitary([(('Y/2',),), (('-X/2',),)]) @ _cz_unitary
+_swap_core = clifford_to_unitary([('cz', ('-Y/2',), 'cz', ('Y/2',), 'cz', ('I',)),
+                                  ('cz', ('Y/2',), 'cz', ('-Y/2',), 'cz', ('Y/2',))])
+
+
+def _kron_stack(q1_unitaries, q0_unitaries):
+    return np.einsum('nij,nkl->nikjl', q1_unitaries, q0_unitaries).reshape(-1, 4, 4)
+
+
+def indices_to_unitaries(indices):
+    """
+    vectorized version of `clifford_to_unitary(index_to_clifford(index))`
+
+    :param indices: an array of C2 indices of shape (N,)
+    :return: the unitaries as an array of shape (N, 4, 4)
+    """
+    indices = np.asarray(indices).ravel()
+    unitaries = np.empty((indices.size, 4, 4), dtype=complex)
+
+    mask = indices < 576
+    q0c1, q1c1 = np.unravel_index(indices[mask], (24, 24))
+    unitaries[mask] = _kron_stack(_c1_unitaries[q1c1], _c1_unitaries[q0c1])
+
+    mask = (indices >= 576) & (indices < 576 + 5184)
+    q0c1, q1c1, q0s1, q1s1y2 = np.unravel_index(indices[mask] - 576, (24, 24, 3, 3))
+    unitaries[mask] = _kron_stack(_s1y2_unitaries[q1s1y2], _s1_unitaries[q0s1]) @ _cnot_core @ \
+        _kron_stack(_c1_unitaries[q1c1], _c1_unitaries[q0c1])
+
+    mask = (indices >= 576 + 5184) & (indices < 576 + 2 * 5184)
+    q0c1, q1c1, q0s1y2, q1s1x2 = np.unravel_index(indices[mask] - (576 + 5184), (24, 24, 3, 3))
+    unitaries[mask] = _kron_stack(_s1x2_unitaries[q1s1x2], _s1y2_unitaries[q0s1y2]) @ _iswap_core @ \
+        _kron_stack(_c1_unitaries[q1c1], _c1_unitaries[q0c1])
+
+    mask = indices >= 576 + 2 * 5184
+    q0c1, q1c1 = np.unravel_index(indices[mask] - (576 + 2 * 5184), (24, 24))
+    unitaries[mask] = _swap_core @ _kron_stack(_c1_unitaries[q1c1], _c1_unitaries[q0c1])
+
+    return unitaries
+
+
+# the tables are cached (uncompressed, so they can be memory mapped and shared between processes) under a directory
+# that is keyed by the native decomposition, so changing it regenerates them
+_tables_dir = os.environ.get('RB2_TABLES_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'rb2'))
+_tables_version = hashlib.sha1(repr((_c1_ops, _s1_ops, _s1x2_ops, _s1y2_ops)).encode()).hexdigest()[:12]
+
+
+def _table_path(filename):
+    return os.path.join(_tables_dir, _tables_version, filename)
+
+
+@contextmanager
+def _atomic_path(path):
+    # yields a temporary path to write to, which is renamed to path on success, so concurrent readers never see a
+    # partial table
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _save_table(filename, array):
+    with _atomic_path(_table_path(filename)) as tmp_path:
+        with open(tmp_path, 'wb') as tmp_file:
+            np.save(tmp_file, array)
+
+
+@lru_cache(maxsize=None)
+def get_c2_unitaries():
+    """
+    the (11520, 4, 4) table of C2 unitaries, loaded on first use and regenerated if missing
+    """
+    if not os.path.exists(_table_path('c2_unitaries.npy')):
+        _save_table('c2_unitaries.npy', indices_to_unitaries(np.arange(size_c2)))
+    return np.load(_table_path('c2_unitaries.npy'), mmap_mode='r')
 
 
 def is_phase(unitary):
@@ -143,19 +266,151 @@ def is_phase(unitary):
         return False
 
 
+# fingerprints are phase invariant: each unitary is rotated so that its first non-negligible entry is real and
+# positive, then quantized and hashed. entries of C2 unitaries are in {0, +-1/2, +-1/sqrt(2), +-1} (times a
+# phase), so the quantization grid is far from any rounding boundary
+_fingerprint_pivot_threshold = 0.1
+_fingerprint_scale = 2 ** 10
+_fingerprint_weights = np.random.default_rng(1402).integers(1, 2 ** 62, size=32, dtype=np.int64) | 1
+
+
+def unitary_fingerprint(unitaries):
+    """
+    global phase invariant hash of a unitary or of a stack of unitaries
+
+    :param unitaries: an array of shape (..., 4, 4)
+    :return: an int64 fingerprint (array of shape (...,) for a stack)
+    """
+    unitaries = np.asarray(unitaries)
+    flat = unitaries.reshape(-1, unitaries.shape[-2] * unitaries.shape[-1])
+    pivots = flat[np.arange(flat.shape[0]), np.argmax(np.abs(flat) > _fingerprint_pivot_threshold, axis=1)]
+    pivots = np.where(np.abs(pivots) > _fingerprint_pivot_threshold, pivots, 1.0)
+    normalized = flat * (np.abs(pivots) / pivots)[:, None]
+    quantized = np.rint(np.concatenate([normalized.real, normalized.imag], axis=1) * _fingerprint_scale)
+    fingerprints = quantized.astype(np.int64) @ _fingerprint_weights  # wraps around on overflow
+    return fingerprints.reshape(unitaries.shape[:-2])
+
+
+@lru_cache(maxsize=None)
+def _get_c2_fingerprint_index():
+    fingerprint_index = {fp: i for i, fp in enumerate(unitary_fingerprint(get_c2_unitaries()).tolist())}
+    assert len(fingerprint_index) == size_c2, "C2 fingerprints are not unique"
+    return fingerprint_index
+
+
+def _fingerprints_to_indices(fingerprints, sorted_fingerprints, fingerprint_order):
+    positions = np.searchsorted(sorted_fingerprints, fingerprints).clip(max=size_c2 - 1)
+    assert np.all(sorted_fingerprints[positions] == fingerprints), "algrithm failed, product is not in C2"
+    return fingerprint_order[positions]
+
+
+def _build_mult_tables():
+    """
+    build the C2 composition and inverse tables from the C2 unitaries
+
+    the composition table is defined by c2_unitaries[c2_mult_table[a, b]] ~ c2_unitaries[a] @ c2_unitaries[b] (up to
+    a global phase), i.e. b is applied first. the inverse table satisfies c2_mult_table[c2_inverse_table[a], a] ==
+    c2_identity_index
+    """
+    c2_unitaries = np.asarray(get_c2_unitaries())
+    fingerprints = unitary_fingerprint(c2_unitaries)
+    fingerprint_order = np.argsort(fingerprints)
+    sorted_fingerprints = fingerprints[fingerprint_order]
+
+    with _atomic_path(_table_path('c2_mult_table.npy')) as tmp_path:
+        mult_table = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.int16, shape=(size_c2, size_c2))
+        for a in range(size_c2):
+            mult_table[a] = _fingerprints_to_indices(unitary_fingerprint(c2_unitaries[a] @ c2_unitaries),
+                                                     sorted_fingerprints, fingerprint_order)
+        mult_table.flush()
+        del mult_table
+
+    inverse_table = _fingerprints_to_indices(unitary_fingerprint(c2_unitaries.conj().transpose(0, 2, 1)),
+                                             sorted_fingerprints, fingerprint_order).astype(np.int16)
+    _save_table('c2_inverse_table.npy', inverse_table)
+
+
+def _ensure_mult_tables():
+    if not all(os.path.exists(_table_path(filename)) for filename in ('c2_mult_table.npy', 'c2_inverse_table.npy')):
+        print('building multiplication table...')  # careful, this takes a few minutes and writes a ~265MB table
+        _build_mult_tables()
+
+
+@lru_cache(maxsize=None)
+def get_c2_mult_table():
+    """
+    the memory mapped (11520, 11520) int16 C2 composition table, built on first use if missing
+    """
+    _ensure_mult_tables()
+    return np.load(_table_path('c2_mult_table.npy'), mmap_mode='r')
+
+
+@lru_cache(maxsize=None)
+def get_c2_inverse_table():
+    """
+    the (11520,) int16 C2 inverse table, built on first use if missing
+    """
+    _ensure_mult_tables()
+    return np.load(_table_path('c2_inverse_table.npy'))
+
+
+_lazy_tables = {
+    'c2_unitaries': get_c2_unitaries,
+    'c2_mult_table': get_c2_mult_table,
+    'c2_inverse_table': get_c2_inverse_table,
+}
+
+
+def __getattr__(name):
+    # keeps `from c2_generator import c2_unitaries` working without loading the tables at import time
+    if name in _lazy_tables:
+        return _lazy_tables[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def unitary_to_index(unitary):
     matches = []
-    prod_unitaries = unitary.conj().T @ c2_unitaries
-    eye4 = np.eye(4)
-    for i in range(size_c2):
-        if np.abs(np.abs(prod_unitaries[i, 0, 0]) - 1) < 1e-10:
-            if np.max(np.abs(prod_unitaries[i] / prod_unitaries[i, 0, 0] - eye4)) < 1e-10:
-                matches.append(i)
+    index = _get_c2_fingerprint_index().get(int(unitary_fingerprint(unitary)))
+    if index is not None:
+        # a hash hit is confirmed against the table so that non Clifford inputs can never be matched
+        prod_unitary = unitary.conj().T @ get_c2_unitaries()[index]
+        if np.abs(np.abs(prod_unitary[0, 0]) - 1) < 1e-10:
+            if np.max(np.abs(prod_unitary / prod_unitary[0, 0] - np.eye(4))) < 1e-10:
+                matches.append(index)
     assert len(matches) == 1, f"algrithm failed, found {len(matches)} matches > 1"
 
     return matches[0]
 
 
+class CliffordTruncation(Sequence):
+    """
+    a truncation of an RB sequence followed by its inverse Clifford
+
+    the truncation is a view of the first `length` Cliffords of the main sequence, which is shared between all
+    truncations instead of being copied
+    """
+
+    def __init__(self, main_seq: List, length: int, inverse_clifford):
+        self._main_seq = main_seq
+        self._length = length
+        self.inverse_clifford = inverse_clifford
+
+    def __len__(self):
+        return self._length + 1
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('truncation index out of range')
+        return self._main_seq[item] if item < self._length else self.inverse_clifford
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 def generate_clifford_truncations(seq_len: int,
                                   truncations_positions: Optional[List] = None,
                                   seed: Optional[int] = None):
@@ -166,28 +421,242 @@ def generate_clifford_truncations(seq_len: int,
         truncations_positions = range(seq_len)
     else:
         set_truncations = set(truncations_positions)
-        set_truncations.add(seq_len)
-        truncations_positions.append(sorted(list(set_truncations)))
+        set_truncations.add(seq_len - 1)  # the full sequence
+        truncations_positions = sorted(set_truncations)
 
     # generate total sequence:
-    main_seq = [index_to_clifford(index) for index in np.random.randint(size_c2, size=seq_len)]
-    main_seq_unitaries = [clifford_to_unitary(seq) for seq in main_seq]
-    truncations_plus_inverse = []
+    main_seq_indices = np.random.randint(size_c2, size=seq_len)
+    main_seq = [index_to_clifford(index) for index in main_seq_indices]
+
+    # running prefix products in index space, prefix_products[pos] is the product of main_seq[:pos + 1]
+    c2_mult_table = get_c2_mult_table()
+    c2_inverse_table = get_c2_inverse_table()
+    prefix_products = np.empty(seq_len, dtype=np.int16)
+    trunc_index_prod = c2_identity_index
+    for pos, index in enumerate(main_seq_indices):
+        trunc_index_prod = c2_mult_table[index, trunc_index_prod]
+        prefix_products[pos] = trunc_index_prod
 
     # generate truncations:
+    truncations_plus_inverse = []
     for pos in truncations_positions:
-        trunc = main_seq[:pos + 1]
-        trunc_unitary = main_seq_unitaries[:pos + 1]
-        trunc_unitary_prod = np.eye(4)
-        for unitary in trunc_unitary:
-            trunc_unitary_prod = unitary @ trunc_unitary_prod
-        inverse_unitary = trunc_unitary_prod.conj().T
-        inverse_clifford = index_to_clifford(unitary_to_index(inverse_unitary))
-        trunc.append(inverse_clifford)
-        truncations_plus_inverse.append(trunc)
+        inverse_clifford = index_to_clifford(int(c2_inverse_table[prefix_products[pos]]))
+        truncations_plus_inverse.append(CliffordTruncation(main_seq, pos + 1, inverse_clifford))
     return truncations_plus_inverse
 
 
+@dataclass
+class RBSequenceSet:
+    """
+    a compact set of RB sequences, stored as C2 indices
+
+    :param sequences: int16 array of shape (seeds, max_len + 1). the first max_len columns are the random Cliffords
+                      and the last column is the inverse of the full sequence
+    :param inverses: int16 array of shape (seeds, len(lengths)) with the inverse Clifford of every truncation
+    :param lengths: the truncation lengths (number of random Cliffords before the inverse)
+    :param interleaved_index: for interleaved RB, the C2 index of the gate that follows every random Clifford
+    """
+    sequences: np.ndarray
+    inverses: np.ndarray
+    lengths: np.ndarray
+    interleaved_index: Optional[int] = None
+
+    @property
+    def num_seeds(self):
+        return self.sequences.shape[0]
+
+    def truncation_indices(self, seed: int, length_index: int) -> np.ndarray:
+        random_indices = self.sequences[seed, :self.lengths[length_index]]
+        if self.interleaved_index is not None:
+            random_indices = np.stack([random_indices, np.full_like(random_indices, self.interleaved_index)],
+                                      axis=1).ravel()
+        return np.append(random_indices, self.inverses[seed, length_index])
+
+    def truncation(self, seed: int, length_index: int) -> List:
+        """
+        the gate tuples of a single truncation, expanded from the indices only when requested
+        """
+        return [index_to_clifford(int(index)) for index in self.truncation_indices(seed, length_index)]
+
+
+def _seed_generators(num_seeds: int, seed: Optional[Union[int, np.random.SeedSequence]] = None):
+    # independent streams, one per RB seed, so every sequence can be generated (and reproduced) on its own
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [np.random.default_rng(child) for child in seed.spawn(num_seeds)]
+
+
+def _prefix_products(sequences: np.ndarray) -> np.ndarray:
+    # running C2 products along the last axis, vectorized over all leading axes
+    c2_mult_table = get_c2_mult_table()
+    prefix_products = np.empty(sequences.shape, dtype=np.int16)
+    trunc_index_prod = np.full(sequences.shape[:-1], c2_identity_index, dtype=np.int16)
+    for pos in range(sequences.shape[-1]):
+        trunc_index_prod = c2_mult_table[sequences[..., pos], trunc_index_prod]
+        prefix_products[..., pos] = trunc_index_prod
+    return prefix_products
+
+
+def _check_lengths(lengths) -> np.ndarray:
+    lengths = np.asarray(lengths, dtype=int)
+    if lengths.ndim != 1 or lengths.size == 0 or np.any(lengths < 1):
+        raise ValueError(f"lengths must be a non empty list of positive integers, got {lengths}")
+    return lengths
+
+
+def _random_sequences(num_sequences: int, max_len: int,
+                      seed: Optional[Union[int, np.random.SeedSequence]] = None) -> np.ndarray:
+    # (num_sequences, max_len + 1) array, the last column is left for the inverse
+    sequences = np.empty((num_sequences, max_len + 1), dtype=np.int16)
+    for row, rng in zip(sequences, _seed_generators(num_sequences, seed)):
+        row[:max_len] = rng.integers(size_c2, size=max_len)
+    return sequences
+
+
+def _close_sequences(sequences: np.ndarray, lengths: np.ndarray, interleaved_index: Optional[int] = None):
+    # fills the last column of `sequences` with the inverse of the full sequence and returns the inverses of all
+    # truncations. with an interleaved gate g, every random Clifford c is followed by g, i.e. composes to g @ c
+    random_indices = sequences[..., :-1]
+    if interleaved_index is not None:
+        random_indices = get_c2_mult_table()[interleaved_index, random_indices]
+    prefix_products = _prefix_products(random_indices)
+    c2_inverse_table = get_c2_inverse_table()
+    sequences[..., -1] = c2_inverse_table[prefix_products[..., -1]]
+    return c2_inverse_table[prefix_products[..., lengths - 1]]
+
+
+def generate_rb_sequences(num_seeds: int,
+                          lengths: List[int],
+                          seed: Optional[Union[int, np.random.SeedSequence]] = None) -> RBSequenceSet:
+    """
+    generate a batch of two qubit RB sequences in index space
+
+    :param num_seeds: number of independent random sequences
+    :param lengths: truncation lengths, all truncations of a seed share the same random sequence
+    :param seed: a seed (or `SeedSequence`) from which an independent stream is spawned per RB seed
+    :return: an `RBSequenceSet`
+    """
+    lengths = _check_lengths(lengths)
+    sequences = _random_sequences(num_seeds, lengths.max(), seed)
+    inverses = _close_sequences(sequences, lengths)
+    return RBSequenceSet(sequences, inverses, lengths)
+
+
+def generate_interleaved_rb_sequences(num_seeds: int,
+                                      lengths: List[int],
+                                      interleaved_unitary: np.ndarray,
+                                      seed: Optional[Union[int, np.random.SeedSequence]] = None
+                                      ) -> Tuple[RBSequenceSet, RBSequenceSet]:
+    """
+    generate matching reference and interleaved two qubit RB sequence sets
+
+    both sets use the same random Cliffords. in the interleaved set the target gate follows every random Clifford, and
+    the inverse recovers the whole interleaved sequence
+
+    :param num_seeds: number of independent random sequences
+    :param lengths: truncation lengths, in number of random Cliffords
+    :param interleaved_unitary: the 4x4 unitary of the interleaved gate, must be a two qubit Clifford
+    :param seed: a seed (or `SeedSequence`) from which an independent stream is spawned per RB seed
+    :return: a tuple (reference, interleaved) of `RBSequenceSet`
+    """
+    interleaved_index = unitary_to_index(np.asarray(interleaved_unitary))
+    lengths = _check_lengths(lengths)
+    sequences = _random_sequences(num_seeds, lengths.max(), seed)
+    interleaved_sequences = sequences.copy()
+    reference = RBSequenceSet(sequences, _close_sequences(sequences, lengths), lengths)
+    interleaved = RBSequenceSet(interleaved_sequences,
+                                _close_sequences(interleaved_sequences, lengths, interleaved_index),
+                                lengths,
+                                interleaved_index)
+    return reference, interleaved
+
+
+@dataclass
+class SimultaneousRBSequenceSet:
+    """
+    independent RB sequences for several disjoint qubit pairs that share a single length axis
+
+    :param pairs: the qubit pairs, the first axis of `sequences` and `inverses` follows this order
+    :param sequences: int16 array of shape (pairs, seeds, max_len + 1), see `RBSequenceSet`
+    :param inverses: int16 array of shape (pairs, seeds, len(lengths))
+    :param lengths: the truncation lengths, common to all pairs
+    """
+    pairs: List[Tuple[int, int]]
+    sequences: np.ndarray
+    inverses: np.ndarray
+    lengths: np.ndarray
+
+    @property
+    def num_seeds(self):
+        return self.sequences.shape[1]
+
+    def pair_set(self, pair_index: int) -> RBSequenceSet:
+        return RBSequenceSet(self.sequences[pair_index], self.inverses[pair_index], self.lengths)
+
+    def truncation_indices(self, seed: int, length_index: int) -> np.ndarray:
+        """
+        the indices of a truncation for all pairs at once, as a (pairs, length + 1) array
+        """
+        return np.concatenate([self.sequences[:, seed, :self.lengths[length_index]],
+                               self.inverses[:, seed, length_index, None]], axis=1)
+
+    def truncation(self, seed: int, length_index: int) -> List[List]:
+        """
+        the gate tuples of a truncation, one list per pair, expanded from the indices only when requested
+        """
+        return [[index_to_clifford(int(index)) for index in pair_indices]
+                for pair_indices in self.truncation_indices(seed, length_index)]
+
+
+def generate_simultaneous_rb_sequences(pairs: List[Tuple[int, int]],
+                                       num_seeds: int,
+                                       lengths: List[int],
+                                       seed: Optional[Union[int, np.random.SeedSequence]] = None
+                                       ) -> SimultaneousRBSequenceSet:
+    """
+    generate independent two qubit RB sequences for many disjoint qubit pairs in one batch
+
+    :param pairs: disjoint qubit pairs, e.g. [(0, 1), (2, 3)]
+    :param num_seeds: number of random sequences per pair
+    :param lengths: truncation lengths, shared by all pairs
+    :param seed: a seed (or `SeedSequence`) from which an independent stream is spawned per pair and RB seed
+    :return: a `SimultaneousRBSequenceSet`
+    """
+    pairs = [tuple(pair) for pair in pairs]
+    qubits = [qubit for pair in pairs for qubit in pair]
+    if any(len(pair) != 2 for pair in pairs) or len(set(qubits)) != len(qubits):
+        raise ValueError(f"pairs must be disjoint qubit pairs, got {pairs}")
+    lengths = _check_lengths(lengths)
+    sequences = _random_sequences(len(pairs) * num_seeds, lengths.max(), seed).reshape(len(pairs), num_seeds, -1)
+    inverses = _close_sequences(sequences, lengths)
+    return SimultaneousRBSequenceSet(pairs, sequences, inverses, lengths)
+
+
+def fuse_single_qubit_gates(clifford_seq) -> List[Tuple]:
+    """
+    fuse every run of single qubit gates between entangling gates into a single C1 element
+
+    :param clifford_seq: Cliffords in the `index_to_clifford` format, e.g. a truncation
+    :return: one gate list in the `index_to_clifford` format for the whole sequence. every single qubit layer is the
+             minimal native decomposition of the fused run, and the empty tuple for the identity, so that the idle
+             qubit is only padded with 'I' where the other qubit plays a pulse
+    """
+    layers = ([], [])
+    fused_c1 = [0, 0]
+    for clifford in clifford_seq:
+        for q0g, q1g in zip(*clifford):
+            if q0g == 'cz':
+                for qubit in range(2):
+                    layers[qubit].extend([_c1_min_ops[fused_c1[qubit]], 'cz'])
+                fused_c1 = [0, 0]
+            else:
+                fused_c1 = [_c1_mult_table[_ops_to_c1_index(q0g), fused_c1[0]],
+                            _c1_mult_table[_ops_to_c1_index(q1g), fused_c1[1]]]
+    for qubit in range(2):
+        layers[qubit].append(_c1_min_ops[fused_c1[qubit]])
+    return [tuple(layers[0]), tuple(layers[1])]
+
+
 def _clifford_seq_to_qiskit_circ(clifford_seq):
     qc = QuantumCircuit(2)
     for clifford in clifford_seq:
@@ -196,13 +665,38 @@ def _clifford_seq_to_qiskit_circ(clifford_seq):
     return qc
 
 
+def _frame_potential_block(unitaries, start, stop):
+    # |tr(U_i^dagger U_j)|^4 summed over a block of rows i and all columns j
+    overlaps = np.einsum('ikl,jkl->ij', unitaries[start:stop].conj(), unitaries, optimize=True)
+    abs_squared = overlaps.real ** 2 + overlaps.imag ** 2
+    return np.sum(abs_squared * abs_squared)
+
+
+def frame_potential(unitaries=None, block_size: int = 512, workers: Optional[int] = None):
+    """
+    the frame potential (1 / N^2) sum_ij |tr(U_i^dagger U_j)|^4 of a set of unitaries
+
+    the set is a unitary 2-design iff this equals 2 (for dimension >= 2)
+
+    :param unitaries: an (N, d, d) array, defaults to the C2 unitaries
+    :param block_size: number of rows per einsum block, bounds the memory to block_size * N overlaps
+    :param workers: if given, the blocks are split across a process pool with this many workers
+    """
+    if unitaries is None:
+        unitaries = get_c2_unitaries()
+    unitaries = np.asarray(unitaries)
+    num_unitaries = unitaries.shape[0]
+    starts = range(0, num_unitaries, block_size)
+    stops = [min(start + block_size, num_unitaries) for start in starts]
+    if workers is None:
+        total = sum(_frame_potential_block(unitaries, start, stop) for start, stop in zip(starts, stops))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            total = sum(executor.map(_frame_potential_block, [unitaries] * len(starts), starts, stops))
+    return total / num_unitaries ** 2
+
+
 if __name__ == '__main__':
     if _test_2_design:
-        sum_2d = 0
-        for i in range(size_c2):
-            if i % 10 == 0:
-                print(i)
-            for j in range(size_c2):
-                sum_2d += np.abs(np.trace(c2_unitaries[i].conj().T @ c2_unitaries[j])) ** 4
         print("2 design ? ")
-        print(sum_2d / size_c2 ** 2)
+        print(frame_potential(workers=os.cpu_count()))
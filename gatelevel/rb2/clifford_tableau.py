@@ -0,0 +1,250 @@
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from lib.c2_generator import _c1_ops, _c1_unitaries, _single_gate_unitaries
+
+# n qubit Cliffords in the stabilizer tableau representation of https://arxiv.org/abs/quant-ph/0406196
+# this does not enumerate the group, so everything here is polynomial in the number of qubits
+
+# single qubit Paulis indexed by x + 2 * z, with Y = iXZ
+_pauli_unitaries = np.array([
+    np.eye(2),
+    [[0, 1], [1, 0]],
+    [[1, 0], [0, -1]],
+    [[0, -1j], [1j, 0]],
+], dtype=complex)
+
+
+def _single_qubit_lut(unitary):
+    # the conjugation action of a single qubit Clifford: local Pauli index -> (image Pauli index, sign bit)
+    images = unitary @ _pauli_unitaries @ unitary.conj().T
+    overlaps = np.einsum('pij,qij->pq', images, _pauli_unitaries.conj()) / 2
+    lut = np.argmax(np.abs(overlaps), axis=1)
+    signs = (overlaps[np.arange(4), lut].real < 0).astype(np.uint8)
+    return lut, signs
+
+
+_gate_luts = {name: _single_qubit_lut(unitary) for name, unitary in _single_gate_unitaries.items()}
+# gates used internally by the synthesis, all of them are mapped back to the native alphabet by `to_gates`
+_synthesis_unitaries = {
+    'h': np.array([[1, 1], [1, -1]], dtype=complex) / np.sqrt(2),
+    's': np.diag([1, 1j]),
+    'sdg': np.diag([1, -1j]),
+    'x': _pauli_unitaries[1],
+    'z': _pauli_unitaries[2],
+}
+_gate_luts.update({name: _single_qubit_lut(unitary) for name, unitary in _synthesis_unitaries.items()})
+_synthesis_inverse = {'h': 'h', 's': 'sdg', 'cz': 'cz'}
+
+
+def _xz_dot(table):
+    # number of qubits on which each row has a Y
+    num_qubits = table.shape[1] // 2
+    return np.sum(table[:, :num_qubits] & table[:, num_qubits:], axis=1, dtype=int)
+
+
+class CliffordTableau:
+    """
+    an n qubit Clifford (up to a global phase) as a stabilizer tableau
+
+    row i of `table` is the image U X_i U^dagger and row n + i the image U Z_i U^dagger, as a Pauli vector (x bits of
+    all qubits followed by the z bits of all qubits) times (-1)^phases[i]. `a @ b` applies b first, like the matrix
+    product of the corresponding unitaries.
+    """
+
+    def __init__(self, table: np.ndarray, phases: np.ndarray):
+        self.table = np.asarray(table, dtype=np.uint8)
+        self.phases = np.asarray(phases, dtype=np.uint8)
+        if self.table.ndim != 2 or self.table.shape[0] != self.table.shape[1] or self.table.shape[0] % 2 or \
+                self.phases.shape != (self.table.shape[0],):
+            raise ValueError(f"invalid tableau shapes {self.table.shape} and {self.phases.shape}")
+
+    @property
+    def num_qubits(self):
+        return self.table.shape[0] // 2
+
+    @classmethod
+    def identity(cls, num_qubits: int) -> 'CliffordTableau':
+        return cls(np.eye(2 * num_qubits, dtype=np.uint8), np.zeros(2 * num_qubits, dtype=np.uint8))
+
+    @classmethod
+    def random(cls, num_qubits: int, seed: Optional[Union[int, np.random.Generator]] = None) -> 'CliffordTableau':
+        """
+        a uniformly random Clifford
+
+        a random symplectic basis is built pair by pair: X_k is mapped to a random non zero vector in the symplectic
+        complement of the previous pairs and Z_k to a random vector there that anticommutes with it. the number of
+        choices at every step does not depend on the previous choices, so the symplectic part is uniform, and the
+        signs are uniform independent bits
+        """
+        rng = np.random.default_rng(seed)
+        n = num_qubits
+        table = np.zeros((2 * n, 2 * n), dtype=np.uint8)
+
+        def symplectic_product(u, v):
+            return (u[..., :n] @ v[n:] + u[..., n:] @ v[:n]) % 2
+
+        def project(v, k):
+            # projection onto the symplectic complement of the first k pairs
+            if k == 0:
+                return v
+            xs, zs = table[:k], table[n:n + k]
+            return (v + symplectic_product(zs, v) @ xs + symplectic_product(xs, v) @ zs) % 2
+
+        for k in range(n):
+            x_image = project(rng.integers(2, size=2 * n, dtype=np.uint8), k)
+            while not x_image.any():
+                x_image = project(rng.integers(2, size=2 * n, dtype=np.uint8), k)
+            z_image = project(rng.integers(2, size=2 * n, dtype=np.uint8), k)
+            while symplectic_product(z_image, x_image) != 1:
+                z_image = project(rng.integers(2, size=2 * n, dtype=np.uint8), k)
+            table[k], table[n + k] = x_image, z_image
+        return cls(table, rng.integers(2, size=2 * n, dtype=np.uint8))
+
+    @classmethod
+    def from_gates(cls, num_qubits: int, gates: List[Tuple[str, Tuple[int, ...]]]) -> 'CliffordTableau':
+        """
+        the Clifford implemented by a gate list in the format returned by `to_gates`
+        """
+        tableau = cls.identity(num_qubits)
+        for name, qubits in gates:
+            tableau._apply(name, qubits)
+        return tableau
+
+    def copy(self) -> 'CliffordTableau':
+        return CliffordTableau(self.table.copy(), self.phases.copy())
+
+    def _apply(self, name, qubits):
+        # in place U -> G U for a gate G
+        n = self.num_qubits
+        if name == 'cz':
+            a, b = qubits
+            x_a, x_b, z_a, z_b = self.table[:, a], self.table[:, b], self.table[:, n + a], self.table[:, n + b]
+            self.phases ^= x_a & x_b & (z_a ^ z_b)
+            z_a ^= x_b
+            z_b ^= x_a
+        else:
+            qubit, = qubits
+            lut, signs = _gate_luts[name]
+            local = self.table[:, qubit] + 2 * self.table[:, n + qubit]
+            self.phases ^= signs[local]
+            self.table[:, qubit] = lut[local] & 1
+            self.table[:, n + qubit] = lut[local] >> 1
+
+    def is_symplectic(self) -> bool:
+        n = self.num_qubits
+        omega = np.block([[np.zeros((n, n)), np.eye(n)], [np.eye(n), np.zeros((n, n))]]).astype(np.uint8)
+        return np.array_equal(self.table @ omega @ self.table.T % 2, omega)
+
+    def __eq__(self, other):
+        if not isinstance(other, CliffordTableau):
+            return NotImplemented
+        return np.array_equal(self.table, other.table) and np.array_equal(self.phases, other.phases)
+
+    def __matmul__(self, other: 'CliffordTableau') -> 'CliffordTableau':
+        if self.num_qubits != other.num_qubits:
+            raise ValueError(f"cannot compose {self.num_qubits} and {other.num_qubits} qubit Cliffords")
+        n = self.num_qubits
+        # Paulis are tracked as i^e X^x Z^z, each row of `other` is a product of generators X_0..X_n-1, Z_0..Z_n-1
+        # (in this order) which are replaced by the rows of `self`
+        self_e = (2 * self.phases.astype(int) + _xz_dot(self.table)) % 4
+        e = (2 * other.phases.astype(int) + _xz_dot(other.table)) % 4
+        x = np.zeros((2 * n, n), dtype=np.uint8)
+        z = np.zeros((2 * n, n), dtype=np.uint8)
+        for k in range(2 * n):
+            rows = other.table[:, k].astype(bool)
+            e[rows] = (e[rows] + self_e[k] + 2 * (z[rows] @ self.table[k, :n])) % 4
+            x[rows] ^= self.table[k, :n]
+            z[rows] ^= self.table[k, n:]
+        table = np.concatenate([x, z], axis=1)
+        return CliffordTableau(table, ((e - _xz_dot(table)) % 4) // 2)
+
+    def inverse(self) -> 'CliffordTableau':
+        n = self.num_qubits
+        omega = np.block([[np.zeros((n, n)), np.eye(n)], [np.eye(n), np.zeros((n, n))]]).astype(np.uint8)
+        symplectic_inverse = CliffordTableau(omega @ self.table.T @ omega % 2, np.zeros(2 * n, dtype=np.uint8))
+        # what is left is a Pauli, which is its own inverse up to a global phase
+        pauli = symplectic_inverse @ self
+        return pauli @ symplectic_inverse
+
+    def _reduction_gates(self):
+        # gates G_1, ..., G_k such that G_k ... G_1 U is a Pauli, and the phases of that Pauli
+        n = self.num_qubits
+        work = self.copy()
+        gates = []
+
+        def apply(name, *qubits):
+            work._apply(name, qubits)
+            gates.append((name, qubits))
+
+        def cnot(control, target):
+            apply('h', target)
+            apply('cz', control, target)
+            apply('h', target)
+
+        for q in range(n):
+            # map the image of X_q to X_q
+            x, z = work.table[q, :n], work.table[q, n:]
+            if not x[q:].any():
+                apply('h', q + np.flatnonzero(z[q:])[0])
+            if not x[q]:
+                cnot(q + np.flatnonzero(x[q:])[0], q)
+            for k in range(q + 1, n):
+                if x[k]:
+                    cnot(q, k)
+            if z[q]:
+                apply('s', q)
+            for k in range(q + 1, n):
+                if z[k]:
+                    apply('h', k)
+                    cnot(q, k)
+
+            # map the image of Z_q to Z_q, keeping X_q
+            x, z = work.table[n + q, :n], work.table[n + q, n:]
+            for k in range(q + 1, n):
+                if x[k] and z[k]:
+                    apply('s', k)
+                if x[k]:
+                    apply('h', k)
+                if z[k]:
+                    cnot(k, q)
+            if x[q]:
+                apply('h', q)
+                apply('s', q)
+                apply('h', q)
+        return gates, work.phases
+
+    def to_gates(self) -> List[Tuple[str, Tuple[int, ...]]]:
+        """
+        decompose into the native alphabet of `_c1_ops` and 'cz'
+
+        :return: a list of (gate, qubits) in the order they are applied, e.g. [('X/2', (0,)), ('cz', (0, 1))]. the
+                 single qubit gates between two 'cz' are fused into a single C1 element
+        """
+        n = self.num_qubits
+        reduction, phases = self._reduction_gates()
+        # U = G_1^dagger ... G_k^dagger P
+        abstract_gates = [('z', (q,)) for q in range(n) if phases[q]] + \
+                         [('x', (q,)) for q in range(n) if phases[n + q]] + \
+                         [(_synthesis_inverse[name], qubits) for name, qubits in reversed(reduction)]
+
+        gates = []
+        pending = [np.eye(2, dtype=complex) for _ in range(n)]
+
+        def flush(qubit):
+            c1_index = np.argmax(np.abs(np.einsum('kij,ij->k', _c1_unitaries.conj(), pending[qubit])))
+            if c1_index != 0:
+                gates.extend((op, (qubit,)) for op in _c1_ops[c1_index])
+            pending[qubit] = np.eye(2, dtype=complex)
+
+        for name, qubits in abstract_gates:
+            if name == 'cz':
+                for qubit in qubits:
+                    flush(qubit)
+                gates.append(('cz', qubits))
+            else:
+                pending[qubits[0]] = _synthesis_unitaries[name] @ pending[qubits[0]]
+        for qubit in range(n):
+            flush(qubit)
+        return gates
@@ -1,41 +1,250 @@
 from collections import UserDict
 from dataclasses import dataclass
+from functools import cached_property, lru_cache
+from typing import Callable, Dict, Tuple
+
+import numpy as np
 
 from lib.gateconcatenator import GateConcatenator, Moment
-from lib.c2_generator import generate_clifford_truncations
+from lib.c2_generator import index_to_clifford, size_c2, RBSequenceSet
 
+# small int codes of the native gates, a moment is a pair (q0 code, q1 code) and a CZ is the moment (cz, cz)
+gate_codes = {
+    'I': 0,
+    'X': 1,
+    'Y': 2,
+    'X/2': 3,
+    'Y/2': 4,
+    '-X/2': 5,
+    '-Y/2': 6,
+    'cz': 7,
+}
+_gate_names = sorted(gate_codes, key=gate_codes.get)
 
-class RB2Generator:
-    pass
+
+def _check_gates(data, what):
+    for key in gate_codes:
+        if key not in data:
+            raise ValueError(f"{what} is missing the mandatory gate '{key}'")
 
 
 class MomentMap(UserDict):
+    """
+    the pulse names of the native gates, keyed by the names of `gate_codes`
+    """
+
     def __init__(self, data):
         super().__init__(data)
-        mandatory_keys = {
-            'I',
-            'X',
-            'Y',
-            'X/2',
-            'Y/2',
-            '-X/2',
-            '-Y/2',
-            'cz'
-        }
-        for key in mandatory_keys:
-            if key not in self.data.keys():
-                raise ValueError('...')
-
-
-clifford_sequence = generate_clifford_truncations(10, [5, 7], 0)
-
-
-def cseq_to_gate_seq(clifford_seq, moment_map: MomentMap):
-    moment_seq = []
-    for clifford in clifford_seq:
-        for q0g, q1g in zip(*clifford):
-            if q0g == 'cz':
-                moment_seq.append()
+        _check_gates(self.data, "moment map")
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.__dict__.pop('table', None)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.__dict__.pop('table', None)
+
+    @cached_property
+    def table(self) -> np.ndarray:
+        """
+        code -> pulse lookup table, indexed by the codes of `gate_codes`. built once, and again after the map changes
+        """
+        table = np.empty(len(_gate_names), dtype=object)
+        table[:] = [self.data[name] for name in _gate_names]
+        return table
+
+    def lookup(self, moments: np.ndarray) -> np.ndarray:
+        """
+        vectorized lookup of the pulses of a moment array (any shape of gate codes)
+        """
+        return self.table[moments]
+
+
+def clifford_to_moments(clifford) -> np.ndarray:
+    """
+    lower a single Clifford in the `index_to_clifford` format to an (moments, 2) array of gate codes
+
+    single qubit layers take as many moments as the longer of the two qubits, the idle qubit is padded with 'I'
+    """
+    moments = []
+    for q0g, q1g in zip(*clifford):
+        if q0g == 'cz':
+            moments.append((gate_codes['cz'], gate_codes['cz']))
+        else:
+            for i in range(max(len(q0g), len(q1g))):
+                moments.append((gate_codes[q0g[i]] if i < len(q0g) else gate_codes['I'],
+                                gate_codes[q1g[i]] if i < len(q1g) else gate_codes['I']))
+    return np.array(moments, dtype=np.int8).reshape(-1, 2)
+
+
+@lru_cache(maxsize=None)
+def _get_c2_moment_table() -> Tuple[np.ndarray, np.ndarray]:
+    # (size_c2, max_moments, 2) gate codes padded with 'I', and the number of moments of every C2 element
+    c2_moments = [clifford_to_moments(index_to_clifford(index)) for index in range(size_c2)]
+    lengths = np.array([len(moments) for moments in c2_moments])
+    table = np.full((size_c2, lengths.max(), 2), gate_codes['I'], dtype=np.int8)
+    for index, moments in enumerate(c2_moments):
+        table[index, :len(moments)] = moments
+    return table, lengths
+
+
+def cseq_to_moments(indices) -> np.ndarray:
+    """
+    lower a sequence of C2 indices to a (moments, 2) array of gate codes with a single gather
+    """
+    table, lengths = _get_c2_moment_table()
+    indices = np.asarray(indices)
+    valid = np.arange(table.shape[1]) < lengths[indices][:, None]
+    return table[indices][valid]
+
+
+def cseqs_to_moments(indices) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    lower a batch of C2 index sequences, e.g. `RBSequenceSet.sequences`, to padded moment arrays
+
+    :param indices: an (sequences, length) array of C2 indices
+    :return: a tuple (moments, num_moments) where moments is an (sequences, max_moments, 2) int8 array padded with
+             'I' and num_moments holds the number of moments of every sequence
+    """
+    table, lengths = _get_c2_moment_table()
+    indices = np.asarray(indices)
+    num_sequences, seq_len = indices.shape
+    valid = (np.arange(table.shape[1]) < lengths[indices][..., None]).reshape(num_sequences, -1)
+    gathered = table[indices].reshape(num_sequences, -1, 2)
+    num_moments = valid.sum(axis=1)
+    moments = np.full((num_sequences, num_moments.max(initial=0), 2), gate_codes['I'], dtype=np.int8)
+    # position of every valid moment within its own sequence
+    positions = np.cumsum(valid, axis=1) - 1
+    rows = np.broadcast_to(np.arange(num_sequences)[:, None], valid.shape)
+    moments[rows[valid], positions[valid]] = gathered[valid]
+    return moments, num_moments
+
+
+def cseq_to_gate_seq(clifford_seq) -> np.ndarray:
+    """
+    lower a sequence of Cliffords in the `index_to_clifford` format (e.g. a truncation) to an (moments, 2) array of
+    gate codes. for sequences of C2 indices prefer `cseq_to_moments`, which does not walk the gate tuples
+    """
+    moments = [clifford_to_moments(clifford) for clifford in clifford_seq]
+    return np.concatenate(moments) if moments else np.zeros((0, 2), dtype=np.int8)
+
+
+class RB2Generator:
+    """
+    a single QUA program that plays any RB sequence of up to `max_moments` moments, so all the sequences share one
+    compile instead of a program per sequence
+
+    the sequences are lowered to moment codes (see `gate_codes`), which are either loaded into QUA int arrays with
+    `declare(int, value=...)` or streamed in through input streams, and every moment is dispatched with `switch_` to
+    `gate_macros`, a dict of QUA macros keyed by the names of `gate_codes`. the single qubit macros are called with
+    the qubit (0 or 1) and the 'cz' macro without arguments, `measure` is called after every sequence
+    """
+
+    input_streams = ('rb_q0_codes', 'rb_q1_codes', 'rb_num_moments')
+
+    def __init__(self, gate_macros: Dict[str, Callable], measure: Callable[[], None]):
+        _check_gates(gate_macros, "gate macros")
+        self.gate_macros = gate_macros
+        self.measure = measure
+
+    @staticmethod
+    def sequence_moments(rb_set: RBSequenceSet) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        the moment codes of all the truncations of an RB sequence set, ordered by seed and then by length
+
+        :return: a tuple (moments, num_moments) as returned by `cseqs_to_moments`
+        """
+        truncations = [cseq_to_moments(rb_set.truncation_indices(seed, length_index))
+                       for seed in range(rb_set.num_seeds) for length_index in range(len(rb_set.lengths))]
+        num_moments = np.array([len(moments) for moments in truncations])
+        moments = np.full((len(truncations), num_moments.max(initial=0), 2), gate_codes['I'], dtype=np.int8)
+        for index, truncation in enumerate(truncations):
+            moments[index, :len(truncation)] = truncation
+        return moments, num_moments
+
+    def _play_moment(self, q0_code, q1_code):
+        from qm.qua import align, case_, else_, if_, switch_
+
+        with if_(q0_code == gate_codes['cz']):
+            align()
+            self.gate_macros['cz']()
+            align()
+        with else_():
+            for qubit, code in enumerate((q0_code, q1_code)):
+                with switch_(code):
+                    for name in _gate_names:
+                        if name != 'cz':
+                            with case_(gate_codes[name]):
+                                self.gate_macros[name](qubit)
+
+    def program(self, moments: np.ndarray, num_moments: np.ndarray, repetitions: int = 1):
+        """
+        a program that plays every sequence `repetitions` times, with the sequences stored in the program itself
+
+        :param moments: (sequences, max_moments, 2) moment codes, e.g. from `sequence_moments`
+        :param num_moments: the number of moments of every sequence
+        """
+        from qm.qua import assign, declare, for_, program
+
+        num_sequences, max_moments, _ = moments.shape
+        with program() as prog:
+            q0_codes = declare(int, value=moments[..., 0].ravel().tolist())
+            q1_codes = declare(int, value=moments[..., 1].ravel().tolist())
+            lengths = declare(int, value=np.asarray(num_moments).tolist())
+            q0_code = declare(int)
+            q1_code = declare(int)
+            rep = declare(int)
+            seq = declare(int)
+            moment = declare(int)
+            with for_(rep, 0, rep < repetitions, rep + 1):
+                with for_(seq, 0, seq < num_sequences, seq + 1):
+                    with for_(moment, 0, moment < lengths[seq], moment + 1):
+                        assign(q0_code, q0_codes[seq * max_moments + moment])
+                        assign(q1_code, q1_codes[seq * max_moments + moment])
+                        self._play_moment(q0_code, q1_code)
+                    self.measure()
+        return prog
+
+    def streaming_program(self, max_moments: int, num_sequences: int, repetitions: int = 1):
+        """
+        a program that waits for every sequence on the input streams of `input_streams` and plays it `repetitions`
+        times, so new sequences can be pushed to a running job with `insert_sequence`
+        """
+        from qm.qua import advance_input_stream, assign, declare, declare_input_stream, for_, program
+
+        with program() as prog:
+            q0_codes = declare_input_stream(int, self.input_streams[0], size=max_moments)
+            q1_codes = declare_input_stream(int, self.input_streams[1], size=max_moments)
+            length = declare_input_stream(int, self.input_streams[2])
+            q0_code = declare(int)
+            q1_code = declare(int)
+            rep = declare(int)
+            seq = declare(int)
+            moment = declare(int)
+            with for_(seq, 0, seq < num_sequences, seq + 1):
+                advance_input_stream(q0_codes)
+                advance_input_stream(q1_codes)
+                advance_input_stream(length)
+                with for_(rep, 0, rep < repetitions, rep + 1):
+                    with for_(moment, 0, moment < length, moment + 1):
+                        assign(q0_code, q0_codes[moment])
+                        assign(q1_code, q1_codes[moment])
+                        self._play_moment(q0_code, q1_code)
+                    self.measure()
+        return prog
+
+    def insert_sequence(self, job, moments: np.ndarray, max_moments: int):
+        """
+        push a single (moments, 2) sequence of moment codes to a job running `streaming_program`
+        """
+        if len(moments) > max_moments:
+            raise ValueError(f"sequence of {len(moments)} moments does not fit in {max_moments} moments")
+        padded = np.full((max_moments, 2), gate_codes['I'], dtype=int)
+        padded[:len(moments)] = moments
+        job.insert_input_stream(self.input_streams[0], padded[:, 0].tolist())
+        job.insert_input_stream(self.input_streams[1], padded[:, 1].tolist())
+        job.insert_input_stream(self.input_streams[2], len(moments))
 
 
 rb_config = GateConcatenator()
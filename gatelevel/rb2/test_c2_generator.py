@@ -3,8 +3,11 @@ import numpy as np
 import pytest
 from qiskit import Aer, execute
 
-from lib.c2_generator import clifford_to_unitary, index_to_clifford, size_c2, unitary_to_index, c2_unitaries, \
-    generate_clifford_truncations, _clifford_seq_to_qiskit_circ, is_phase
+from lib.c2_generator import clifford_to_unitary, index_to_clifford, size_c2, unitary_to_index, \
+    generate_clifford_truncations, _clifford_seq_to_qiskit_circ, is_phase, unitary_fingerprint, \
+    c2_identity_index, indices_to_unitaries, _clifford_to_qiskit_circ, \
+    generate_rb_sequences, get_c2_unitaries, get_c2_mult_table, get_c2_inverse_table, frame_potential, \
+    generate_interleaved_rb_sequences, generate_simultaneous_rb_sequences, fuse_single_qubit_gates, _c1_ops
 
 
 @pytest.mark.parametrize('num_rand', [pytest.param(1),
@@ -19,9 +22,29 @@ def test_clifford_to_unitary(num_rand):
         np.testing.assert_allclose(unitary.conj().T @ unitary, np.eye(4), atol=1e-10)
 
 
+@pytest.mark.parametrize('num_rand', [pytest.param(10),
+                                      pytest.param(1000, marks=pytest.mark.stress)])
+def test_clifford_to_unitary_matches_simulator(num_rand):
+    simulator = Aer.get_backend("unitary_simulator")
+    for index in np.random.randint(size_c2, size=num_rand):
+        clifford = index_to_clifford(index)
+        sim_unitary = execute(_clifford_to_qiskit_circ(clifford), simulator).result().get_unitary()
+        np.testing.assert_allclose(clifford_to_unitary(clifford), sim_unitary, atol=1e-10)
+
+
+def test_indices_to_unitaries():
+    indices = np.random.randint(size_c2, size=100)
+    unitaries = indices_to_unitaries(indices)
+    assert unitaries.shape == (100, 4, 4)
+    for index, unitary in zip(indices, unitaries):
+        np.testing.assert_allclose(unitary, clifford_to_unitary(index_to_clifford(index)), atol=1e-10)
+    np.testing.assert_allclose(indices_to_unitaries(np.arange(size_c2)), get_c2_unitaries(), atol=1e-10)
+
+
 @pytest.mark.parametrize('num_rand', [pytest.param(1),
                                       pytest.param(1000, marks=pytest.mark.stress)])
 def test_unitary_to_index(num_rand):
+    c2_unitaries = get_c2_unitaries()
     indices = np.random.randint(size_c2, size=num_rand)
     for index in indices:
         assert unitary_to_index(c2_unitaries[index]) == index
@@ -39,6 +62,53 @@ def test_find_inverse(num_rand):
         assert is_phase(prod_with_inverse)
 
 
+@pytest.mark.parametrize('num_rand', [pytest.param(1),
+                                      pytest.param(1000, marks=pytest.mark.stress)])
+def test_unitary_to_index_phase_invariant(num_rand):
+    c2_unitaries = get_c2_unitaries()
+    for index in np.random.randint(size_c2, size=num_rand):
+        phase = np.exp(2j * np.pi * np.random.rand())
+        assert unitary_fingerprint(phase * c2_unitaries[index]) == unitary_fingerprint(c2_unitaries[index])
+        assert unitary_to_index(phase * c2_unitaries[index]) == index
+
+
+@pytest.mark.parametrize('num_rand', [pytest.param(10),
+                                      pytest.param(10000, marks=pytest.mark.stress)])
+def test_mult_table(num_rand):
+    c2_unitaries, c2_mult_table = get_c2_unitaries(), get_c2_mult_table()
+    for a, b in np.random.randint(size_c2, size=(num_rand, 2)):
+        prod_unitary = c2_unitaries[a] @ c2_unitaries[b]
+        assert c2_mult_table[a, b] == unitary_to_index(prod_unitary)
+        assert is_phase(c2_unitaries[c2_mult_table[a, b]].conj().T @ prod_unitary)
+
+
+def test_inverse_table():
+    c2_unitaries, c2_mult_table, c2_inverse_table = get_c2_unitaries(), get_c2_mult_table(), get_c2_inverse_table()
+    assert c2_inverse_table.shape == (size_c2,)
+    assert np.all(c2_mult_table[c2_inverse_table, np.arange(size_c2)] == c2_identity_index)
+    for index in np.random.randint(size_c2, size=10):
+        assert c2_inverse_table[index] == unitary_to_index(c2_unitaries[index].conj().T)
+
+
+def test_tables_are_memory_mapped_once():
+    assert get_c2_unitaries() is get_c2_unitaries()
+    assert isinstance(get_c2_unitaries(), np.memmap)
+    assert isinstance(get_c2_mult_table(), np.memmap)
+    assert get_c2_mult_table().dtype == np.int16
+
+
+def test_frame_potential_blocks():
+    unitaries = indices_to_unitaries(np.random.randint(size_c2, size=50))
+    expected = np.mean([np.abs(np.trace(u.conj().T @ v)) ** 4 for u in unitaries for v in unitaries])
+    np.testing.assert_allclose(frame_potential(unitaries, block_size=7), expected)
+    np.testing.assert_allclose(frame_potential(unitaries, block_size=7, workers=2), expected)
+
+
+@pytest.mark.stress
+def test_c2_is_2_design():
+    np.testing.assert_allclose(frame_potential(workers=4), 2.0, rtol=1e-10)
+
+
 def test_unitary_to_index_fails_on_random():
     for _ in range(10):
         randmat = np.random.rand(4, 4) + 1j * np.random.rand(4, 4)
@@ -53,7 +123,7 @@ def test_unitary_to_index_time():
                  number=10) / 10, 'seconds')
     print('\nunitary to index time = ',
           timeit('unitary_to_index(c2_unitaries[534])',
-                 'from lib.c2_generator import c2_unitaries, unitary_to_index',
+                 'from lib.c2_generator import get_c2_unitaries, unitary_to_index; c2_unitaries = get_c2_unitaries()',
                  number=100) / 100, 'seconds')
 
 
@@ -74,6 +144,116 @@ def test_generate_clifford_truncations_basic():
         assert is_phase(unitary)
 
 
+def test_generate_clifford_truncations_positions():
+    truncations = generate_clifford_truncations(20, [3, 7], seed=2)
+    assert [len(trunc) for trunc in truncations] == [5, 9, 21]
+    for trunc in truncations:
+        unitary = np.eye(4)
+        for clifford in trunc:
+            unitary = clifford_to_unitary(clifford) @ unitary
+        assert is_phase(unitary)
+    # truncations share the main sequence
+    assert truncations[0][:4] == truncations[2][:4]
+    assert truncations[0][3] is truncations[2][3]
+
+
+def _is_identity_sequence(indices):
+    unitary = np.eye(4)
+    for unitary_element in indices_to_unitaries(indices):
+        unitary = unitary_element @ unitary
+    return is_phase(unitary)
+
+
+def test_generate_rb_sequences():
+    lengths = [1, 2, 5, 17]
+    rb_set = generate_rb_sequences(8, lengths, seed=3)
+    assert rb_set.sequences.shape == (8, 18)
+    assert rb_set.sequences.dtype == np.int16
+    assert rb_set.inverses.shape == (8, 4)
+    for seed in range(8):
+        assert _is_identity_sequence(rb_set.sequences[seed])
+        for length_index, length in enumerate(lengths):
+            indices = rb_set.truncation_indices(seed, length_index)
+            assert len(indices) == length + 1
+            assert _is_identity_sequence(indices)
+    assert rb_set.truncation(0, 1) == [index_to_clifford(index) for index in rb_set.truncation_indices(0, 1)]
+
+
+def test_generate_rb_sequences_reproducible():
+    rb_set = generate_rb_sequences(4, [3, 10], seed=7)
+    np.testing.assert_array_equal(rb_set.sequences, generate_rb_sequences(4, [3, 10], seed=7).sequences)
+    # every seed has its own stream, so a larger batch extends a smaller one
+    np.testing.assert_array_equal(rb_set.sequences, generate_rb_sequences(6, [3, 10], seed=7).sequences[:4])
+    with pytest.raises(ValueError):
+        generate_rb_sequences(4, [0, 10])
+
+
+def test_generate_interleaved_rb_sequences():
+    cz_unitary = np.diag([1, 1, 1, -1])
+    lengths = [1, 4, 9]
+    reference, interleaved = generate_interleaved_rb_sequences(5, lengths, cz_unitary, seed=11)
+    np.testing.assert_array_equal(reference.sequences[:, :-1], interleaved.sequences[:, :-1])
+    np.testing.assert_array_equal(reference.sequences, generate_rb_sequences(5, lengths, seed=11).sequences)
+    assert interleaved.interleaved_index == unitary_to_index(cz_unitary)
+    for seed in range(5):
+        for length_index, length in enumerate(lengths):
+            indices = interleaved.truncation_indices(seed, length_index)
+            assert len(indices) == 2 * length + 1
+            np.testing.assert_array_equal(indices[:-1:2], reference.truncation_indices(seed, length_index)[:-1])
+            assert np.all(indices[1:-1:2] == interleaved.interleaved_index)
+            assert _is_identity_sequence(indices)
+
+
+def test_generate_interleaved_rb_sequences_fails_on_non_clifford():
+    with pytest.raises(AssertionError):
+        generate_interleaved_rb_sequences(2, [3], np.diag([1, 1, 1, np.exp(1j * np.pi / 4)]))
+
+
+def test_generate_simultaneous_rb_sequences():
+    pairs = [(0, 1), (2, 3), (5, 4)]
+    lengths = [2, 6]
+    sim_set = generate_simultaneous_rb_sequences(pairs, 4, lengths, seed=5)
+    assert sim_set.sequences.shape == (3, 4, 7)
+    assert sim_set.inverses.shape == (3, 4, 2)
+    # pairs are independent
+    assert not np.array_equal(sim_set.sequences[0], sim_set.sequences[1])
+    for seed in range(4):
+        for length_index, length in enumerate(lengths):
+            indices = sim_set.truncation_indices(seed, length_index)
+            assert indices.shape == (3, length + 1)
+            for pair_index, pair_indices in enumerate(indices):
+                np.testing.assert_array_equal(pair_indices,
+                                              sim_set.pair_set(pair_index).truncation_indices(seed, length_index))
+                assert _is_identity_sequence(pair_indices)
+    with pytest.raises(ValueError):
+        generate_simultaneous_rb_sequences([(0, 1), (1, 2)], 4, lengths)
+
+
+def _num_moments(clifford):
+    return sum(1 if q0g == 'cz' else max(len(q0g), len(q1g)) for q0g, q1g in zip(*clifford))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_fuse_single_qubit_gates(seed):
+    trunc = generate_clifford_truncations(30, seed=seed)[-1]
+    fused = fuse_single_qubit_gates(trunc)
+    unitary = np.eye(4)
+    for clifford in trunc:
+        unitary = clifford_to_unitary(clifford) @ unitary
+    assert is_phase(clifford_to_unitary(fused).conj().T @ unitary)
+    assert fused[0].count('cz') == sum(clifford[0].count('cz') for clifford in trunc)
+    assert _num_moments(fused) < sum(_num_moments(clifford) for clifford in trunc)
+    for q0g, q1g in zip(*fused):
+        if q0g != 'cz':
+            assert q0g in _c1_ops[1:] + [()]
+            assert q1g in _c1_ops[1:] + [()]
+
+
+def test_fuse_single_qubit_gates_identity_needs_no_pulse():
+    fused = fuse_single_qubit_gates([[(('X/2',), 'cz', ('-X/2', 'X/2', 'X', 'X')), (('Y',), 'cz', ('Y/2',))]])
+    assert fused == [(('X/2',), 'cz', ()), (('Y',), 'cz', ('Y/2',))]
+
+
 @pytest.mark.stress
 @pytest.mark.parametrize('run', range(20))
 def test_generate_clifford_truncations_stress(run):
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from lib.c2_generator import _single_gate_unitaries, index_to_clifford, clifford_to_unitary, unitary_to_index, \
+    size_c2
+from lib.clifford_tableau import CliffordTableau, _pauli_unitaries
+
+
+def _gates_to_unitary(num_qubits, gates):
+    # q0 is the least significant qubit, as in c2_generator
+    unitary = np.eye(2 ** num_qubits, dtype=complex)
+    for name, qubits in gates:
+        if name == 'cz':
+            bits = (np.arange(2 ** num_qubits)[:, None] >> np.array(qubits)) & 1
+            gate = np.diag(np.where(bits.all(axis=1), -1, 1)).astype(complex)
+        else:
+            gate = np.kron(np.kron(np.eye(2 ** (num_qubits - 1 - qubits[0])), _single_gate_unitaries[name]),
+                           np.eye(2 ** qubits[0]))
+        unitary = gate @ unitary
+    return unitary
+
+
+def _pauli_from_row(num_qubits, row, phase):
+    pauli = np.eye(1)
+    for qubit in reversed(range(num_qubits)):
+        pauli = np.kron(pauli, _pauli_unitaries[row[qubit] + 2 * row[num_qubits + qubit]])
+    return (-1) ** int(phase) * pauli
+
+
+def _assert_implements(tableau, unitary):
+    n = tableau.num_qubits
+    generators = np.eye(2 * n, dtype=np.uint8)
+    for row in range(2 * n):
+        generator = _pauli_from_row(n, generators[row], 0)
+        np.testing.assert_allclose(unitary @ generator @ unitary.conj().T,
+                                   _pauli_from_row(n, tableau.table[row], tableau.phases[row]), atol=1e-10)
+
+
+def _c2_index_to_gates(index):
+    gates = []
+    for q0g, q1g in zip(*index_to_clifford(index)):
+        if q0g == 'cz':
+            gates.append(('cz', (0, 1)))
+        else:
+            gates.extend((op, (0,)) for op in q0g)
+            gates.extend((op, (1,)) for op in q1g)
+    return gates
+
+
+@pytest.mark.parametrize('num_qubits', [1, 2, 3])
+def test_random_tableau_is_symplectic(num_qubits):
+    for seed in range(20):
+        assert CliffordTableau.random(num_qubits, seed).is_symplectic()
+
+
+@pytest.mark.parametrize('num_qubits', [1, 2, 3, 4])
+def test_to_gates(num_qubits):
+    for seed in range(20):
+        tableau = CliffordTableau.random(num_qubits, seed)
+        gates = tableau.to_gates()
+        assert {name for name, _ in gates} <= set(_single_gate_unitaries) | {'cz'}
+        assert CliffordTableau.from_gates(num_qubits, gates) == tableau
+        if num_qubits <= 3:
+            _assert_implements(tableau, _gates_to_unitary(num_qubits, gates))
+
+
+def test_from_c2_gates():
+    for index in np.random.randint(size_c2, size=20):
+        gates = _c2_index_to_gates(index)
+        np.testing.assert_allclose(_gates_to_unitary(2, gates), clifford_to_unitary(index_to_clifford(index)),
+                                   atol=1e-10)
+        tableau = CliffordTableau.from_gates(2, gates)
+        _assert_implements(tableau, clifford_to_unitary(index_to_clifford(index)))
+        assert unitary_to_index(_gates_to_unitary(2, tableau.to_gates())) == index
+
+
+@pytest.mark.parametrize('num_qubits', [1, 2, 3, 5])
+def test_compose_and_inverse(num_qubits):
+    for seed in range(20):
+        rng = np.random.default_rng(seed)
+        a, b = CliffordTableau.random(num_qubits, rng), CliffordTableau.random(num_qubits, rng)
+        assert CliffordTableau.from_gates(num_qubits, b.to_gates() + a.to_gates()) == a @ b
+        assert a.inverse() @ a == CliffordTableau.identity(num_qubits)
+        assert a @ a.inverse() == CliffordTableau.identity(num_qubits)
+        if num_qubits <= 3:
+            unitary = _gates_to_unitary(num_qubits, a.to_gates()) @ _gates_to_unitary(num_qubits, b.to_gates())
+            _assert_implements(a @ b, unitary)
+
+
+def test_random_is_uniform_on_c1():
+    num_samples = 24000
+    rng = np.random.default_rng(0)
+    counts = {}
+    for _ in range(num_samples):
+        tableau = CliffordTableau.random(1, rng)
+        key = (tableau.table.tobytes(), tableau.phases.tobytes())
+        counts[key] = counts.get(key, 0) + 1
+    assert len(counts) == 24
+    expected = num_samples / 24
+    chi2 = sum((count - expected) ** 2 / expected for count in counts.values())
+    assert chi2 < 60  # 23 degrees of freedom
+
+
+@pytest.mark.stress
+def test_random_covers_c2():
+    rng = np.random.default_rng(1)
+    indices = {unitary_to_index(_gates_to_unitary(2, CliffordTableau.random(2, rng).to_gates()))
+               for _ in range(200000)}
+    assert len(indices) == size_c2
+
+
+@pytest.mark.stress
+def test_large_random():
+    tableau = CliffordTableau.random(40, 3)
+    assert tableau.is_symplectic()
+    assert CliffordTableau.from_gates(40, tableau.to_gates()) == tableau
+    assert tableau.inverse() @ tableau == CliffordTableau.identity(40)
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from lib.c2_generator import index_to_clifford, size_c2, generate_rb_sequences
+from lib.rb2generator import MomentMap, gate_codes, clifford_to_moments, cseq_to_moments, cseqs_to_moments, \
+    cseq_to_gate_seq, RB2Generator
+
+_moment_map_data = {'I': 'idle', 'X': 'x180', 'Y': 'y180', 'X/2': 'x90', 'Y/2': 'y90', '-X/2': '-x90',
+                    '-Y/2': '-y90', 'cz': 'cz_flux'}
+
+
+def test_moment_map_mandatory_keys():
+    data = dict(_moment_map_data)
+    data.pop('cz')
+    with pytest.raises(ValueError):
+        MomentMap(data)
+
+
+def test_moment_map_lookup():
+    moment_map = MomentMap(_moment_map_data)
+    moments = np.array([[gate_codes['X/2'], gate_codes['I']], [gate_codes['cz'], gate_codes['cz']]])
+    np.testing.assert_array_equal(moment_map.lookup(moments), [['x90', 'idle'], ['cz_flux', 'cz_flux']])
+    assert moment_map.table is moment_map.table
+    moment_map['X/2'] = 'x90_drag'
+    np.testing.assert_array_equal(moment_map.lookup(moments), [['x90_drag', 'idle'], ['cz_flux', 'cz_flux']])
+
+
+def test_clifford_to_moments():
+    # iSWAP class: (c1, 'cz', ('Y/2',), 'cz', s1y2) on q0 and (c1, 'cz', ('-X/2',), 'cz', s1x2) on q1
+    clifford = [(('X/2', 'Y/2'), 'cz', ('Y/2',), 'cz', ('Y', 'X/2')),
+                (('X',), 'cz', ('-X/2',), 'cz', ('-Y/2',))]
+    c = gate_codes
+    np.testing.assert_array_equal(clifford_to_moments(clifford),
+                                  [[c['X/2'], c['X']], [c['Y/2'], c['I']], [c['cz'], c['cz']], [c['Y/2'], c['-X/2']],
+                                   [c['cz'], c['cz']], [c['Y'], c['-Y/2']], [c['X/2'], c['I']]])
+
+
+def test_cseq_to_moments():
+    indices = np.random.randint(size_c2, size=30)
+    expected = cseq_to_gate_seq([index_to_clifford(index) for index in indices])
+    np.testing.assert_array_equal(cseq_to_moments(indices), expected)
+
+
+def test_cseqs_to_moments():
+    rb_set = generate_rb_sequences(6, [5, 12], seed=0)
+    moments, num_moments = cseqs_to_moments(rb_set.sequences)
+    assert moments.shape == (6, num_moments.max(), 2)
+    for seq_moments, seq_num_moments, indices in zip(moments, num_moments, rb_set.sequences):
+        np.testing.assert_array_equal(seq_moments[:seq_num_moments], cseq_to_moments(indices))
+        assert np.all(seq_moments[seq_num_moments:] == gate_codes['I'])
+
+
+def test_rb2generator_sequence_moments():
+    rb_set = generate_rb_sequences(2, [1, 3, 6], seed=5)
+    moments, num_moments = RB2Generator.sequence_moments(rb_set)
+    assert moments.shape[0] == num_moments.size == 2 * 3
+    truncations = [(seed, length_index) for seed in range(2) for length_index in range(3)]
+    for index, (seed, length_index) in enumerate(truncations):
+        expected = cseq_to_moments(rb_set.truncation_indices(seed, length_index))
+        np.testing.assert_array_equal(moments[index, :num_moments[index]], expected)
+        assert np.all(moments[index, num_moments[index]:] == gate_codes['I'])
+
+
+def _gate_macros(called):
+    # QUA macros that play the pulses of the moment map and record which gates were emitted
+    def single_qubit_gate(name):
+        def macro(qubit):
+            from qm.qua import play
+            called.add(name)
+            play(_moment_map_data[name], f'q{qubit}')
+        return macro
+
+    def cz():
+        from qm.qua import play
+        called.add('cz')
+        play(_moment_map_data['cz'], 'coupler')
+
+    macros = {name: single_qubit_gate(name) for name in _moment_map_data if name != 'cz'}
+    macros['cz'] = cz
+    return macros
+
+
+def _measure():
+    from qm.qua import align, measure
+    align()
+    measure('readout', 'rr', None)
+
+
+def test_rb2generator_gate_macros_mandatory_keys():
+    macros = _gate_macros(set())
+    macros.pop('X/2')
+    with pytest.raises(ValueError):
+        RB2Generator(macros, _measure)
+
+
+def test_rb2generator_programs():
+    moments, num_moments = RB2Generator.sequence_moments(generate_rb_sequences(2, [1, 3], seed=2))
+    for build in (lambda generator: generator.program(moments, num_moments, repetitions=2),
+                  lambda generator: generator.streaming_program(moments.shape[1], num_sequences=4)):
+        called = set()
+        assert build(RB2Generator(_gate_macros(called), _measure)) is not None
+        # every gate has a case in the switch of every moment
+        assert called == set(gate_codes)